@@ -0,0 +1,113 @@
+"""
+JWT authentication without per-request verification and user queries.
+
+Verified tokens are kept in a small in-process LRU keyed by the hash of the
+raw token, until they expire. The users they resolve to are kept in the
+JWT_USER_CACHE_ALIAS cache and dropped whenever the user is saved or
+deleted, see ``api.signals``.
+
+Only the worker that saved the user drops it from a cache local to each
+process, the others would keep authenticating a deactivated user. So the
+users are only cached in a cache the workers share, such as Redis or
+Memcached; with the default local memory cache every request loads its
+user from the database.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from mysite.caches import is_shared
+
+
+def user_cache_key(user_id):
+    return f'api:auth-user:{user_id}'
+
+
+def user_cache():
+    """Return the cache of authenticated users, None when it is not shared by the workers."""
+    cache = caches[getattr(settings, 'JWT_USER_CACHE_ALIAS', 'default')]
+    return cache if is_shared(cache) else None
+
+
+class TokenCache:
+    """Thread-safe LRU of verified tokens that forgets them once they expire."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._tokens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._tokens.get(key)
+            if entry is None:
+                return None
+            token, expires = entry
+            if expires <= time.time():
+                del self._tokens[key]
+                return None
+            self._tokens.move_to_end(key)
+            return token
+
+    def set(self, key, token):
+        expires = token.get('exp')
+        if expires is None:
+            return
+        with self._lock:
+            self._tokens[key] = (token, expires)
+            self._tokens.move_to_end(key)
+            while len(self._tokens) > self.max_size:
+                self._tokens.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+
+
+token_cache = TokenCache(getattr(settings, 'JWT_TOKEN_CACHE_SIZE', 1024))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that remembers verified tokens and the users they belong to."""
+
+    def get_validated_token(self, raw_token):
+        key = hashlib.sha256(raw_token).hexdigest()
+        token = token_cache.get(key)
+        if token is None:
+            token = super().get_validated_token(raw_token)
+            token_cache.set(key, token)
+        return token
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        cache = user_cache()
+        user = cache.get(user_cache_key(user_id)) if cache is not None else None
+        if user is None:
+            try:
+                user = self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_('User not found'), code='user_not_found')
+            if cache is not None:
+                cache.set(user_cache_key(user_id), user, getattr(settings, 'JWT_USER_CACHE_TIMEOUT', 300))
+
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+        return user
@@ -0,0 +1,154 @@
+"""
+Blacklist checks for refresh tokens without a query per token.
+
+Each worker keeps a Bloom filter of the JTIs on the blacklist. A token that
+is not in the filter is certainly not blacklisted; only a hit is confirmed
+against the database. The filter is built on first use, tokens blacklisted
+by this worker are added as it happens, and the others are pulled in when
+the blacklist version in the JWT_BLACKLIST_CACHE_ALIAS cache changes, see
+``api.signals``, and at least every JWT_BLACKLIST_FILTER_SYNC_INTERVAL
+seconds. Entries are never removed from a Bloom filter, so pruned tokens
+only cost a query until the next full rebuild.
+
+The version only reaches the other workers through a cache they share,
+such as Redis or Memcached. With a cache local to each process, like the
+default local memory cache, the filter stays off and every check queries
+the database - a token revoked by one worker is refused by all of them.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from mysite.caches import is_shared
+
+VERSION_KEY = 'api:blacklist:version'
+# Tokens blacklisted this long before the last sync are read again, in case they committed late
+SYNC_OVERLAP = timedelta(minutes=5)
+
+
+class BloomFilter:
+    """Set membership with false positives but no false negatives."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(capacity, 1)
+        self.size = max(math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / self.capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class BlacklistFilter:
+    """The blacklisted JTIs of this worker, kept in step with the database."""
+
+    def __init__(self, cache_alias=None):
+        self._cache_alias = cache_alias
+        self._lock = threading.Lock()
+        self.reset()
+
+    @property
+    def cache(self):
+        return caches[self._cache_alias or getattr(settings, 'JWT_BLACKLIST_CACHE_ALIAS', 'default')]
+
+    @property
+    def enabled(self):
+        """Whether the filter is used - only with a cache that tells every worker about new entries."""
+        return is_shared(self.cache)
+
+    def reset(self):
+        with self._lock:
+            self._filter = None
+            self._version = None
+            self._synced_at = None
+
+    def bump_version(self):
+        """Tell the filters of every worker to read the entries added since their last sync."""
+        self.cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+    def _current_version(self):
+        version = self.cache.get(VERSION_KEY)
+        if version is None:
+            version = time.time_ns()
+            if not self.cache.add(VERSION_KEY, version, timeout=None):
+                version = self.cache.get(VERSION_KEY, version)
+        return version
+
+    def _rebuild(self, version, now):
+        jtis = list(
+            BlacklistedToken.objects.filter(token__expires_at__gt=now).values_list('token__jti', flat=True)
+        )
+        capacity = getattr(settings, 'JWT_BLACKLIST_FILTER_CAPACITY', 10000)
+        bloom = BloomFilter(max(capacity, 2 * len(jtis)), getattr(settings, 'JWT_BLACKLIST_FILTER_ERROR_RATE', 0.001))
+        for jti in jtis:
+            bloom.add(jti)
+        self._filter, self._version, self._synced_at = bloom, version, now
+
+    def _sync(self, version, now):
+        jtis = BlacklistedToken.objects.filter(blacklisted_at__gte=self._synced_at - SYNC_OVERLAP).values_list(
+            'token__jti', flat=True
+        )
+        for jti in jtis:
+            self._filter.add(jti)
+        self._version, self._synced_at = version, now
+
+    def _filter_for_check(self):
+        # Read the version before the rows, so anything committed after it bumps it again
+        version = self._current_version()
+        interval = timedelta(seconds=getattr(settings, 'JWT_BLACKLIST_FILTER_SYNC_INTERVAL', 60))
+        with self._lock:
+            now = timezone.now()
+            if self._filter is None or self._filter.count > self._filter.capacity:
+                self._rebuild(version, now)
+            elif version != self._version or now - self._synced_at >= interval:
+                # also on a timer, in case a bump was evicted or lost
+                self._sync(version, now)
+            return self._filter
+
+    def add(self, jti):
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(jti)
+
+    def is_blacklisted(self, jti):
+        if self.enabled and jti not in self._filter_for_check():
+            return False
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+blacklist_filter = BlacklistFilter()
+
+
+def bump_version():
+    blacklist_filter.bump_version()
+
+
+class FilteredRefreshToken(RefreshToken):
+    """RefreshToken that checks the blacklist through ``blacklist_filter``."""
+
+    def check_blacklist(self):
+        if blacklist_filter.is_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_('Token is blacklisted'))
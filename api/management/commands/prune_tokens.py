@@ -0,0 +1,42 @@
+"""
+Delete expired refresh tokens in batches.
+
+simplejwt's ``flushexpiredtokens`` deletes every expired token and its
+blacklist entry in a single DELETE. On a large table that one statement
+holds the write lock for as long as it runs - on SQLite the whole database -
+so logins, which write new tokens, wait behind it. This command deletes the
+same rows a batch per transaction instead.
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+
+class Command(BaseCommand):
+    help = 'Delete expired refresh tokens and their blacklist entries, a batch at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of tokens to delete per transaction.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        now = timezone.now()
+        deleted = 0
+        # Small transactions, so logins writing new tokens never wait long for the lock.
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    OutstandingToken.objects.filter(expires_at__lte=now)
+                    .order_by('pk')
+                    .values_list('pk', flat=True)[:batch_size]
+                )
+                if not batch:
+                    break
+                # Blacklist entries go with their tokens by cascade
+                OutstandingToken.objects.filter(pk__in=batch).delete()
+            deleted += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'Pruned {deleted} expired tokens.'))
@@ -1,11 +1,24 @@
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from food.models import Item, Comment
 from users.models import Profile
+from users.images import variant_urls
 from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
 
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.serializers import (
+    TokenBlacklistSerializer,
+    TokenObtainPairSerializer,
+    TokenRefreshSerializer,
+    TokenVerifySerializer,
+)
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.tokens import RefreshToken, UntypedToken
+
+from .blacklist import FilteredRefreshToken, blacklist_filter
+from .sparse import SparseFieldsMixin, sparse_fields
 
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
@@ -25,6 +38,24 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
         return data
 
 
+class FilteredTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = FilteredRefreshToken
+
+
+class FilteredTokenBlacklistSerializer(TokenBlacklistSerializer):
+    token_class = FilteredRefreshToken
+
+
+class FilteredTokenVerifySerializer(TokenVerifySerializer):
+    def validate(self, attrs):
+        token = UntypedToken(attrs['token'])
+        if api_settings.BLACKLIST_AFTER_ROTATION and blacklist_filter.is_blacklisted(
+            token.get(api_settings.JTI_CLAIM)
+        ):
+            raise serializers.ValidationError('Token is blacklisted')
+        return {}
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -36,22 +67,65 @@ class UserSerializer(serializers.ModelSerializer):
 class UserSerializerWithToken(UserSerializer):
     """Serializer for users with tokens for authentication """
     token = serializers.SerializerMethodField(read_only=True)
+    refresh = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'token']
+        fields = ['id', 'username', 'email', 'token', 'refresh']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # pairs minted by this serializer, by user id - with many=True the child serializes every user
+        self._minted = {}
+
+    def get_tokens(self, obj):
+        """
+        Return the ``(access, refresh)`` pair of the user, minting it only once per user.
+
+        Pass pairs already issued as ``tokens`` in the context, a dict by user
+        id, to reuse them. Every refresh token minted is a row in the blacklist
+        app's tables.
+        """
+        issued = self.context.get('tokens', {})
+        if obj.pk in issued:
+            return issued[obj.pk]
+        if obj.pk not in self._minted:
+            refresh = RefreshToken.for_user(obj)
+            self._minted[obj.pk] = (str(refresh.access_token), str(refresh))
+        return self._minted[obj.pk]
 
     def get_token(self, obj):
-        token = RefreshToken.for_user(obj)
-        return str(token.access_token)
+        return self.get_tokens(obj)[0]
+
+    def get_refresh(self, obj):
+        return self.get_tokens(obj)[1]
+
+
+class ThumbnailsField(serializers.ReadOnlyField):
+    """URLs of the resized variants of a profile picture, by size and format."""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = 'image'
+        super().__init__(**kwargs)
+
+    def to_representation(self, image):
+        request = self.context.get('request')
+        urls = variant_urls(image)
+        if request is not None:
+            urls = {
+                size: {fmt: request.build_absolute_uri(url) for fmt, url in formats.items()}
+                for size, formats in urls.items()
+            }
+        return urls
 
 
 class ProfileImageSerializer(serializers.ModelSerializer):
     """Serializer for uploading images to profiles"""
+    thumbnails = ThumbnailsField()
 
     class Meta:
         model = Profile
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'thumbnails']
         read_only_fields = ['id']
         extra_kwargs = {
             'image': {'required': 'True'},
@@ -60,13 +134,17 @@ class ProfileImageSerializer(serializers.ModelSerializer):
         }
 
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer()
     # image = ProfileImageSerializer
+    thumbnails = ThumbnailsField()
+
+    expandable_fields = ('user',)
+    field_sources = {'thumbnails': ('image',)}
 
     class Meta:
         model = Profile
-        fields = ['id', 'user', 'image', 'location']
+        fields = ['id', 'user', 'image', 'thumbnails', 'location']
         read_only_fields = ['id']
 
     def create(self, validated_data):
@@ -95,9 +173,36 @@ class ProfileSerializer(serializers.ModelSerializer):
         return instance
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class PrefetchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key field that looks the object up in ``context['related_objects']``.
+
+    The bulk endpoints put there the objects every entry of a request refers
+    to, fetched in one query - see ``BulkMixin`` - instead of one query per
+    entry. Anywhere else it works like PrimaryKeyRelatedField.
+    """
+
+    def to_internal_value(self, data):
+        objects = self.context.get('related_objects', {}).get(self.field_name)
+        if objects is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = self.get_queryset().model._meta.pk.to_python(data)
+        except DjangoValidationError:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in objects:
+            self.fail('does_not_exist', pk_value=data)
+        return objects[pk]
+
+
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField
     user = UserSerializer(read_only=True)
 
+    expandable_fields = ('user',)
+
     class Meta:
         model = Comment
         fields = ['id', 'user', 'item', 'text', 'created_at']
@@ -110,9 +215,20 @@ class CommentSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class ItemSerializer(serializers.ModelSerializer):
+def latest_comments_limit():
+    """Number of comments embedded in each serialized item."""
+    return getattr(settings, 'API_ITEM_COMMENTS_LIMIT', 5)
+
+
+class ItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user_name = UserSerializer(read_only=True)
     comments = serializers.SerializerMethodField()
+    comment_count = serializers.SerializerMethodField()
+    comments_url = serializers.SerializerMethodField()
+    image_url = serializers.ReadOnlyField()
+
+    expandable_fields = ('user_name',)
+    field_sources = {'image_url': ('item_image', 'image_asset'), 'comments_url': ()}
 
     class Meta:
         model = Item
@@ -121,19 +237,51 @@ class ItemSerializer(serializers.ModelSerializer):
             'user_name',
             'item_name',
             'item_desc',
+            'item_desc_html',
+            'item_excerpt',
             'item_image',
+            'image_url',
             'publish_date',
             'update_date',
             'cooking_time',
             'views',
+            'rating_average',
+            'rating_count',
             'comments',
+            'comment_count',
+            'comments_url',
+        ]
+        read_only_fields = [
+            'id', 'user_name', 'item_desc_html', 'item_excerpt', 'publish_date', 'update_date', 'views',
+            'rating_average', 'rating_count',
         ]
-        read_only_fields = ['id', 'user_name', 'publish_date', 'update_date', 'views',]
+        # the raw description is only written - reads get the sanitized HTML stored from it
+        extra_kwargs = {'item_desc': {'write_only': True}}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # lists carry the excerpt, the HTML comes with a single recipe or with ?fields=item_desc_html
+        view = self.context.get('view')
+        if getattr(view, 'action', None) == 'list' and sparse_fields(self.context.get('request')).fields is None:
+            fields.pop('item_desc_html', None)
+        return fields
 
     def get_comments(self, obj):
-        comments = obj.comments.all()
+        """Return the latest comments, the full list is under comments_url."""
+        comments = getattr(obj, 'latest_comments', None)
+        if comments is None:
+            comments = obj.comments.select_related('user').order_by('-created_at', '-id')[:latest_comments_limit()]
         return CommentSerializer(comments, many=True).data
 
+    def get_comment_count(self, obj):
+        count = getattr(obj, 'comment_count', None)
+        if count is None:
+            count = obj.comments.count()
+        return count
+
+    def get_comments_url(self, obj):
+        return reverse('item-comments', args=[obj.pk], request=self.context.get('request'))
+
     def create(self, validated_data):
         request = self.context.get('request', None)
         if request:
@@ -0,0 +1,24 @@
+from django.db.models.signals import post_save, post_delete
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from . import blacklist
+from .authentication import user_cache, user_cache_key
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_authenticated_user(sender, instance, **kwargs):
+    # Deactivated, deleted or edited users must not be served from the auth cache
+    cache = user_cache()
+    if cache is not None:
+        cache.delete(user_cache_key(instance.pk))
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def add_to_blacklist_filter(sender, instance, created, **kwargs):
+    if created:
+        blacklist.blacklist_filter.add(instance.token.jti)
+        # Other workers pull it in once it is committed
+        transaction.on_commit(blacklist.bump_version)
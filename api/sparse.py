@@ -0,0 +1,85 @@
+"""
+Sparse fieldsets for API reads.
+
+``?fields=id,item_name`` returns only the listed fields, and
+``?expand=user_name`` embeds a related object instead of giving its id.
+Without either parameter a read returns the full representation, with every
+related object embedded, as before. The views use the same parameters to
+load only the columns, joins and prefetches the requested fields need.
+"""
+from rest_framework import permissions, serializers
+
+
+def _names(value):
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class SparseFields:
+    """The fields and expansions a request asked for."""
+
+    def __init__(self, fields=None, expand=None):
+        self.sparse = fields is not None or expand is not None
+        self.fields = fields
+        self.expand = expand or set()
+
+    def includes(self, name):
+        return self.fields is None or name in self.fields
+
+    def expands(self, name):
+        return self.includes(name) and (not self.sparse or name in self.expand)
+
+
+def sparse_fields(request):
+    """Read ``fields`` and ``expand`` from a read request, writes always get every field."""
+    if request is None or request.method not in permissions.SAFE_METHODS:
+        return SparseFields()
+    fields = request.query_params.get('fields')
+    expand = request.query_params.get('expand')
+    return SparseFields(
+        fields=_names(fields) if fields is not None else None,
+        expand=_names(expand) if expand is not None else None,
+    )
+
+
+class SparseFieldsMixin:
+    """
+    Serializer mixin for ``?fields=`` and ``?expand=``.
+
+    ``expandable_fields`` are nested serializers given as a primary key
+    unless expanded. ``field_sources`` names the model fields read by
+    serializer fields that are not model fields themselves.
+    """
+    expandable_fields = ()
+    field_sources = {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        sparse = sparse_fields(self.context.get('request'))
+        if not sparse.sparse:
+            return fields
+        fields = {name: field for name, field in fields.items() if sparse.includes(name)}
+        for name in self.expandable_fields:
+            if name in fields and not sparse.expands(name):
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+        return fields
+
+    @classmethod
+    def model_fields(cls, sparse):
+        """Return the model fields the requested fields read, None when all of them are needed."""
+        if sparse.fields is None:
+            return None
+        concrete = {field.name for field in cls.Meta.model._meta.concrete_fields}
+        names = set()
+        for name in sparse.fields:
+            names.update(source for source in cls.field_sources.get(name, (name,)) if source in concrete)
+        return names
+
+
+def trim_queryset(queryset, serializer_class, sparse, ordering=(), related=()):
+    """Join ``related`` and load only the columns the requested fields and the ordering need."""
+    if related:
+        queryset = queryset.select_related(*related)
+    only = serializer_class.model_fields(sparse)
+    if only is not None:
+        queryset = queryset.only('id', *(order.lstrip('-') for order in ordering), *only, *related)
+    return queryset
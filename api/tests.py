@@ -1,22 +1,38 @@
 """
 Create tests for the API.
 """
+import json
 import tempfile
 import os
 from datetime import timedelta, datetime
+from types import SimpleNamespace
 from django.utils import timezone
 import pytz
 from deepdiff import DeepDiff
 from PIL import Image
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django.contrib.auth.models import User
 from food.models import Item, Comment
+from food.fragments import get_version
 from users.models import Profile
+from users.images import delete_variants
+from api.authentication import token_cache
+from api.blacklist import BlacklistFilter, BloomFilter, FilteredRefreshToken, blacklist_filter
+from django.core.cache import cache
+from unittest.mock import patch
 from django.urls import reverse
-from rest_framework_simplejwt.tokens import RefreshToken
+from io import StringIO
+from django.core.management import call_command
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from star_ratings.models import Rating
+from mysite.query_budget import QueryBudgetTestMixin
 
 
-from rest_framework.test import APIClient, APITestCase
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase
 from rest_framework import status
 from api.serializers import (
     UserSerializer,
@@ -24,6 +40,7 @@ from api.serializers import (
     ProfileSerializer,
     ItemSerializer,
     CommentSerializer,
+    UserSerializerWithToken,
 )
 
 
@@ -58,6 +75,16 @@ def create_item(user, **params):
     return item
 
 
+def serializer_context(**context):
+    """Context of a serializer called from a view, with a request for the absolute links."""
+    return {'request': Request(APIRequestFactory().get('/')), **context}
+
+
+def list_representation(items):
+    """Serialize items as the list endpoint does - with the excerpt but not the description HTML."""
+    return ItemSerializer(items, many=True, context=serializer_context(view=SimpleNamespace(action='list'))).data
+
+
 def normalize_cooking_time(cooking_time):
     """Normalize cooking time to match the response format."""
     if isinstance(cooking_time, str):
@@ -120,6 +147,7 @@ class PrivateUserAPITest(TestCase):
                 'email': self.user.email,
             },
             'image': f'http://testserver{self.user.profile.image.url}',
+            'thumbnails': {},
             'location': self.user.profile.location,
         })
 
@@ -140,6 +168,7 @@ class PrivateUserAPITest(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
 
 
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
 class ImageUploadTests(TestCase):
     """Tests for the image upload API."""
 
@@ -172,6 +201,44 @@ class ImageUploadTests(TestCase):
         self.assertIn('image', res.data)
         self.assertTrue(os.path.exists(self.user.profile.image.path))
 
+    def test_upload_image_builds_thumbnails(self):
+        """Test uploading a picture creates resized JPEG and WebP variants."""
+        url = reverse('upload-image', args=[self.user.profile.id])
+        with tempfile.NamedTemporaryFile(suffix='.png') as image_file:
+            Image.new('RGBA', (800, 600)).save(image_file, format='PNG')
+            image_file.seek(0)
+            res = self.client.post(url, {'image': image_file}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.user.profile.refresh_from_db()
+        base = os.path.splitext(self.user.profile.image.path)[0]
+        for size in (150, 300):
+            for extension, fmt in (('jpg', 'JPEG'), ('webp', 'WEBP')):
+                with Image.open(f'{base}_{size}.{extension}') as thumbnail:
+                    self.assertEqual(thumbnail.size, (size, size))
+                    self.assertEqual(thumbnail.format, fmt)
+            self.assertTrue(res.data['thumbnails'][size]['webp'].endswith(f'_{size}.webp'))
+        self.assertTrue(self.user.profile.thumbnail_url.endswith('_150.jpg'))
+        delete_variants(self.user.profile.image)
+
+    def test_replaced_image_thumbnails_are_deleted(self):
+        """Test uploading a new picture deletes the thumbnails of the previous one."""
+        url = reverse('upload-image', args=[self.user.profile.id])
+        bases = []
+        for _ in range(2):
+            with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+                Image.new('RGB', (400, 400)).save(image_file, format='JPEG')
+                image_file.seek(0)
+                with self.captureOnCommitCallbacks(execute=True):
+                    res = self.client.post(url, {'image': image_file}, format='multipart')
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.user.profile.refresh_from_db()
+            bases.append(os.path.splitext(self.user.profile.image.path)[0])
+        self.assertFalse(os.path.exists(f'{bases[0]}_150.jpg'))
+        self.assertFalse(os.path.exists(f'{bases[0]}_300.webp'))
+        self.assertTrue(os.path.exists(f'{bases[1]}_150.jpg'))
+        delete_variants(self.user.profile.image)
+
 
 class PublicRecipeApi(TestCase):
     """Test unauthenticated API clients get list view."""
@@ -219,7 +286,7 @@ class PublicRecipeApi(TestCase):
         url = ITEM_DETAIL_URL(item.id)
         res = self.client.get(url)
         item.refresh_from_db()
-        serializer = ItemSerializer(item)
+        serializer = ItemSerializer(item, context=serializer_context())
 
         # Normalize the response data to ensure consistency
         normalized_res_data = res.data.copy()
@@ -264,14 +331,14 @@ class PrivateRecipeApiTests(TestCase):
 
         url = ITEM_LIST_URL
         items = Item.objects.all().order_by('id')
-        serializer = ItemSerializer(items, many=True)
+        expected = list_representation(items)
         res = self.client.get(url)
 
-        for item in res.data:
+        for item in res.data['results']:
             item['cooking_time'] = normalize_cooking_time(item['cooking_time'])
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], expected)
 
     def test_recipe_list_all_to_user(self):
         """Test list of all recipes is retrieved by the authenticated user."""
@@ -285,13 +352,25 @@ class PrivateRecipeApiTests(TestCase):
 
         res = self.client.get(ITEM_LIST_URL)
         items = Item.objects.all()
-        serializer = ItemSerializer(items, many=True)
+        expected = list_representation(items)
 
-        for item in res.data:
+        for item in res.data['results']:
             item['cooking_time'] = normalize_cooking_time(item['cooking_time'])
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], expected)
+
+    def test_recipes_ordered_by_rating(self):
+        """Test recipes are listed with the highest rating first."""
+        low = create_item(user=self.user, item_name='Low')
+        high = create_item(user=self.user, item_name='High')
+        Rating.objects.rate(low, 2, user=self.user)
+        Rating.objects.rate(high, 5, user=self.user)
+
+        res = self.client.get(ITEM_LIST_URL)
+
+        self.assertEqual([item['id'] for item in res.data['results']], [high.id, low.id])
+        self.assertEqual(res.data['results'][0]['rating_count'], 1)
 
     def test_get_recipe_detail(self):
         """Test get recipe detail."""
@@ -299,10 +378,25 @@ class PrivateRecipeApiTests(TestCase):
 
         url = ITEM_DETAIL_URL(item.id)
         res = self.client.get(url)
-        serializer = ItemSerializer(item)
+        serializer = ItemSerializer(item, context=serializer_context())
 
         self.assertEqual(res.data, serializer.data)
 
+    def test_description_is_read_sanitized(self):
+        """Test reads return the sanitized HTML, never the raw description, and lists only the excerpt."""
+        item = create_item(user=self.user, item_desc='<p onclick="evil()">Hot</p><script>x</script>')
+        res = self.client.get(ITEM_DETAIL_URL(item.id))
+        self.assertEqual(res.data['item_desc_html'], '<p>Hot</p>')
+        self.assertNotIn('item_desc', res.data)
+
+        res = self.client.get(ITEM_LIST_URL)
+        self.assertEqual(res.data['results'][0]['item_excerpt'], 'Hot')
+        self.assertNotIn('item_desc', res.data['results'][0])
+        self.assertNotIn('item_desc_html', res.data['results'][0])
+
+        res = self.client.get(ITEM_LIST_URL, {'fields': 'id,item_desc_html'})
+        self.assertEqual(res.data['results'][0], {'id': item.id, 'item_desc_html': '<p>Hot</p>'})
+
     def test_create_recipe(self):
         """Test creating a recipe"""
         payload = {
@@ -433,6 +527,46 @@ class PrivateRecipeApiTests(TestCase):
         comment_data = CommentSerializer(comment_sample).data
         self.assertIn(comment_data, res.data['comments'])
 
+    def test_recipe_embeds_latest_comments_only(self):
+        """Test a recipe embeds its latest comments and links to the rest."""
+        item = create_item(user=self.user)
+        comments = [
+            Comment.objects.create(user=self.user, item=item, text=f'Comment {i}')
+            for i in range(7)
+        ]
+
+        with self.settings(API_ITEM_COMMENTS_LIMIT=3):
+            res = self.client.get(ITEM_DETAIL_URL(item.id))
+
+        self.assertEqual(res.data['comment_count'], 7)
+        self.assertEqual(
+            [comment['id'] for comment in res.data['comments']],
+            [comment.id for comment in reversed(comments[-3:])],
+        )
+        self.assertEqual(res.data['comments_url'], f"http://testserver{reverse('item-comments', args=[item.id])}")
+
+        res = self.client.get(res.data['comments_url'], {'page_size': 5})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(res.data['next'])
+        self.assertEqual(len(res.data['results']), 5)
+
+        res = self.client.get(res.data['next'])
+        self.assertEqual(len(res.data['results']), 2)
+        self.assertIsNone(res.data['next'])
+
+    def test_recipe_list_query_count_is_constant(self):
+        """Test listing recipes does not run queries per recipe or comment."""
+        for i in range(5):
+            other = create_user(username=f'author{i}', password='testpass123')
+            item = create_item(user=other)
+            for _ in range(3):
+                Comment.objects.create(user=other, item=item, text='Sample comment')
+
+        # catalogue version, recipes, latest comments with their users
+        with self.assertNumQueries(3):
+            res = self.client.get(ITEM_LIST_URL)
+        self.assertEqual(len(res.data['results']), 5)
+
     def test_create_comment(self):
         """Test creating a comment."""
         self.item = create_item(user=self.user)
@@ -495,6 +629,177 @@ class PrivateRecipeApiTests(TestCase):
         self.assertTrue(Comment.objects.filter(id=comment.id).exists())
 
 
+class ConditionalGetTests(TestCase):
+    """Test the item endpoints answer conditional requests."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(username='example', password='testpass123')
+        self.item = create_item(user=self.user)
+
+    def test_retrieve_not_modified(self):
+        """Test an unchanged recipe is answered with 304 after one query for its version."""
+        url = ITEM_DETAIL_URL(self.item.id)
+        res = self.client.get(url)
+        etag = res['ETag']
+        self.assertIn('Last-Modified', res)
+
+        with self.assertNumQueries(1):
+            res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.item.item_name = 'Renamed'
+        self.item.save()
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['item_name'], 'Renamed')
+
+    def test_list_not_modified_until_a_comment_is_added(self):
+        """Test the recipe list is revalidated against the latest change."""
+        res = self.client.get(ITEM_LIST_URL)
+        etag = res['ETag']
+        res = self.client.get(ITEM_LIST_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Comment.objects.create(user=self.user, item=self.item, text='Sample comment')
+        res = self.client.get(ITEM_LIST_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_list_not_modified_until_an_item_is_deleted(self):
+        """Test deleting a recipe that was not the latest change still changes the list version."""
+        other = create_item(user=self.user, item_name='Latest')
+        res = self.client.get(ITEM_LIST_URL)
+        etag = res['ETag']
+        with self.assertNumQueries(1):
+            res = self.client.get(ITEM_LIST_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.item.delete()
+        res = self.client.get(ITEM_LIST_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['id'] for row in res.data['results']], [other.id])
+
+
+class PaginationTests(TestCase):
+    """Test cursor pagination of the API list endpoints."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(username='example', password='testpass123')
+        self.client.force_authenticate(self.user)
+
+    def collect(self, url, **params):
+        """Follow next links and return the ids of every page."""
+        pages = []
+        res = self.client.get(url, params)
+        while True:
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            pages.append([row['id'] for row in res.data['results']])
+            if not res.data['next']:
+                return pages
+            res = self.client.get(res.data['next'])
+
+    def test_items_paginated_by_rating_then_id(self):
+        """Test recipe pages follow the rating ordering without gaps or repeats."""
+        items = [create_item(user=self.user, item_name=f'Recipe {i}') for i in range(7)]
+        Rating.objects.rate(items[3], 5, user=self.user)
+        Rating.objects.rate(items[5], 4, user=self.user)
+
+        pages = self.collect(ITEM_LIST_URL, page_size=3)
+
+        expected = [items[3].id, items[5].id] + [item.id for item in items if item not in (items[3], items[5])]
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_comments_paginated_newest_first(self):
+        """Test comment pages are ordered newest first and link back."""
+        item = create_item(user=self.user)
+        comments = [Comment.objects.create(user=self.user, item=item, text=str(i)) for i in range(5)]
+
+        pages = self.collect(reverse('comment-list'), page_size=2)
+        self.assertEqual(sum(pages, []), [comment.id for comment in reversed(comments)])
+
+        res = self.client.get(reverse('comment-list'), {'page_size': 2})
+        res = self.client.get(res.data['next'])
+        res = self.client.get(res.data['previous'])
+        self.assertEqual([row['id'] for row in res.data['results']], [comments[4].id, comments[3].id])
+        self.assertIsNone(res.data['previous'])
+
+    def test_list_endpoints_are_paginated(self):
+        """Test users and profiles are paginated too."""
+        for url in (reverse('user-list'), reverse('profile-list')):
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertIn('results', res.data)
+            self.assertIn('next', res.data)
+
+    def test_invalid_cursor(self):
+        """Test a malformed cursor returns a 404."""
+        res = self.client.get(ITEM_LIST_URL, {'cursor': 'not-a-cursor'})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+# Two workers, each with a local memory cache of its own
+WORKER_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'first': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'first'},
+    'second': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'second'},
+}
+
+
+class CachedAuthenticationTests(APITestCase):
+    """Test JWT authentication is served from the caches."""
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.user = create_user(username='example', password='testpass123')
+        access = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    @patch('api.authentication.is_shared', return_value=True)
+    def test_authenticated_reads_run_no_auth_queries(self, is_shared):
+        """Test only the first request loads the user."""
+        url = reverse('user-detail', args=[self.user.id])
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        # Only the user of the detail page itself
+        with self.assertNumQueries(1):
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_token_is_verified_once(self):
+        """Test a verified token is not decoded again."""
+        url = reverse('user-detail', args=[self.user.id])
+        self.client.get(url)
+        with patch('rest_framework_simplejwt.authentication.JWTAuthentication.get_validated_token') as verify:
+            res = self.client.get(url)
+        verify.assert_not_called()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    @patch('api.authentication.is_shared', return_value=True)
+    def test_deactivated_user_is_rejected(self, is_shared):
+        """Test changes to the user drop it from the cache."""
+        url = reverse('user-detail', args=[self.user.id])
+        self.client.get(url)
+        self.user.is_active = False
+        self.user.save()
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(CACHES=WORKER_CACHES, JWT_USER_CACHE_ALIAS='first')
+    def test_local_cache_loads_user_every_request(self):
+        """Test a user deactivated by another worker is rejected when the cache is local to each worker."""
+        url = reverse('user-detail', args=[self.user.id])
+        self.client.get(url)
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        # deactivated without the signal reaching this worker's cache
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
 class AuthenticationTests(APITestCase):
 
     def setUp(self):
@@ -536,3 +841,334 @@ class AuthenticationTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
         self.assertNotIn('access', response.data)
         self.assertNotIn('refresh', response.data)
+
+    def test_login_issues_one_token(self):
+        """Test a login stores a single outstanding refresh token."""
+        self.client.post(self.url_login, {'username': 'testuser', 'password': 'testpass'})
+        self.assertEqual(OutstandingToken.objects.filter(user=self.user).count(), 1)
+
+    def test_registration_issues_one_token_pair(self):
+        """Test registering returns a pair minted from one refresh token."""
+        res = self.client.post(CREATE_USER_URL, {'username': 'newuser', 'email': 'new@example.com'})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        outstanding = OutstandingToken.objects.get(user__username='newuser')
+        self.assertEqual(res.data['refresh'], outstanding.token)
+        self.assertEqual(AccessToken(res.data['token'])['user_id'], outstanding.user_id)
+
+    def test_each_user_gets_their_own_pair(self):
+        """Test serializing several users mints a pair for each, and ignores issued pairs of other users."""
+        other = create_user(username='otheruser', password='testpass')
+        issued = {self.user.pk: ('access', 'refresh')}
+        data = UserSerializerWithToken([self.user, other], many=True, context={'tokens': issued}).data
+        self.assertEqual((data[0]['token'], data[0]['refresh']), ('access', 'refresh'))
+        self.assertEqual(AccessToken(data[1]['token'])['user_id'], other.pk)
+        self.assertEqual(RefreshToken(data[1]['refresh'])['user_id'], other.pk)
+
+    def test_prune_tokens(self):
+        """Test expired tokens and their blacklist entries are deleted."""
+        self.client.post(self.url_login, {'username': 'testuser', 'password': 'testpass'})
+        fresh = OutstandingToken.objects.get()
+        expired = OutstandingToken.objects.create(
+            user=self.user, jti='expired', token='expired', expires_at=timezone.now() - timedelta(days=1),
+        )
+        BlacklistedToken.objects.create(token=expired)
+        call_command('prune_tokens', batch_size=1, stdout=StringIO())
+        self.assertQuerysetEqual(OutstandingToken.objects.all(), [fresh])
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+
+class BlacklistFilterTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        blacklist_filter.reset()
+
+    @patch('api.blacklist.is_shared', return_value=True)
+    def test_unlisted_token_skips_database(self, is_shared):
+        """Test a token missing from the filter is checked without a query."""
+        refresh = str(RefreshToken.for_user(self.user))
+        FilteredRefreshToken(refresh)
+        with self.assertNumQueries(0):
+            FilteredRefreshToken(refresh)
+
+    def test_local_cache_checks_database(self):
+        """Test the filter is off when the cache is local to each worker."""
+        refresh = str(RefreshToken.for_user(self.user))
+        FilteredRefreshToken(refresh)
+        with self.assertNumQueries(1):
+            FilteredRefreshToken(refresh)
+
+    def test_blacklisted_token_is_rejected(self):
+        """Test a token blacklisted by this worker cannot be refreshed."""
+        refresh = str(RefreshToken.for_user(self.user))
+        FilteredRefreshToken(refresh)
+        res = self.client.post(reverse('jwt-refresh'), {'refresh': refresh})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        FilteredRefreshToken(refresh).blacklist()
+        res = self.client.post(reverse('jwt-refresh'), {'refresh': refresh})
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def blacklist_elsewhere(self, other, jti):
+        """Blacklist a token the way another worker does, with its own filter."""
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=OutstandingToken.objects.get(jti=jti))])
+        other.add(jti)
+        other.bump_version()
+
+    @override_settings(CACHES=WORKER_CACHES)
+    def test_blacklist_from_other_worker_with_local_caches(self):
+        """Test a token blacklisted by a worker with a cache of its own is refused by the others."""
+        first, second = BlacklistFilter('first'), BlacklistFilter('second')
+        jti = RefreshToken.for_user(self.user)['jti']
+        self.assertFalse(first.is_blacklisted(jti))
+        self.blacklist_elsewhere(second, jti)
+        self.assertTrue(first.is_blacklisted(jti))
+
+    @override_settings(CACHES=WORKER_CACHES)
+    @patch('api.blacklist.is_shared', return_value=True)
+    def test_blacklist_from_other_worker_with_shared_cache(self, is_shared):
+        """Test tokens blacklisted elsewhere are picked up when the shared version changes."""
+        first, second = BlacklistFilter('first'), BlacklistFilter('first')
+        jti = RefreshToken.for_user(self.user)['jti']
+        self.assertFalse(first.is_blacklisted(jti))
+        self.blacklist_elsewhere(second, jti)
+        self.assertTrue(first.is_blacklisted(jti))
+
+    @override_settings(CACHES=WORKER_CACHES, JWT_BLACKLIST_FILTER_SYNC_INTERVAL=0)
+    @patch('api.blacklist.is_shared', return_value=True)
+    def test_filter_resyncs_on_a_timer(self, is_shared):
+        """Test entries whose version bump was lost are read once the sync interval passed."""
+        first = BlacklistFilter('first')
+        jti = RefreshToken.for_user(self.user)['jti']
+        self.assertFalse(first.is_blacklisted(jti))
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=OutstandingToken.objects.get(jti=jti))])
+        self.assertTrue(first.is_blacklisted(jti))
+
+    def test_bloom_filter(self):
+        """Test the filter has no false negatives."""
+        bloom = BloomFilter(100, 0.01)
+        keys = [str(i) for i in range(100)]
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+        self.assertLess(sum(str(i) in bloom for i in range(100, 1100)), 50)
+
+
+class BulkTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(username='testuser', password='testpass')
+        self.other_user = create_user(username='otheruser', password='testpass')
+        self.client.force_authenticate(self.user)
+        self.url = reverse('item-bulk')
+
+    def test_bulk_create_items(self):
+        """Test valid items are created and invalid ones reported."""
+        payload = [
+            {'item_name': 'Soup', 'item_desc': '<p>Hot</p><script>x</script>', 'cooking_time': '00:20:00',
+             'item_image': 'https://example.com/soup.png'},
+            {'item_name': 'No cooking time'},
+            {'item_name': 'Salad', 'item_desc': 'Green', 'cooking_time': '00:05:00',
+             'item_image': 'https://example.com/salad.png'},
+        ]
+        with self.captureOnCommitCallbacks(execute=True), patch('food.images.ingest_queue.put') as queue_image:
+            res = self.client.post(self.url, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([r['status'] for r in res.data['results']], [201, 400, 201])
+        # the images are left to the ingest_recipe_images command
+        queue_image.assert_not_called()
+        self.assertIn('cooking_time', res.data['results'][1]['errors'])
+        soup = Item.objects.get(pk=res.data['results'][0]['id'])
+        self.assertEqual(soup.user_name, self.user)
+        self.assertEqual(soup.item_desc_html, '<p>Hot</p>')
+        self.assertEqual(soup.item_excerpt, 'Hot')
+
+    def test_bulk_update_checks_owner(self):
+        """Test only the user's own items are updated."""
+        own = create_item(user=self.user)
+        other = create_item(user=self.other_user)
+        payload = [
+            {'id': own.pk, 'item_desc': 'Updated <b>desc</b>'},
+            {'id': other.pk, 'item_name': 'Hijacked'},
+            {'id': 0, 'item_name': 'Missing'},
+        ]
+        res = self.client.patch(self.url, payload, format='json')
+        self.assertEqual([r['status'] for r in res.data['results']], [200, 403, 404])
+        own.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(own.item_desc_text, 'Updated desc')
+        self.assertEqual(other.item_name, 'Sample Recipe')
+
+    def test_bulk_update_bumps_versions(self):
+        own = create_item(user=self.user)
+        version = get_version(own.pk)
+        res = self.client.patch(self.url, [{'id': own.pk, 'item_name': 'Renamed'}], format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(get_version(own.pk), version)
+
+    def test_bulk_delete_comments(self):
+        """Test comments are deleted by id, only by their authors."""
+        item = create_item(user=self.user)
+        own = Comment.objects.create(item=item, user=self.user, text='Mine')
+        other = Comment.objects.create(item=item, user=self.other_user, text='Theirs')
+        res = self.client.delete(reverse('comment-bulk'), [own.pk, other.pk], format='json')
+        self.assertEqual([r['status'] for r in res.data['results']], [204, 403])
+        self.assertQuerysetEqual(Comment.objects.all(), [other])
+
+    def test_bulk_create_comments_fetches_items_once(self):
+        """Test the items the comments refer to are looked up in one query, whatever the number of entries."""
+        items = [create_item(user=self.other_user) for _ in range(4)]
+        url = reverse('comment-bulk')
+        queries = []
+        for size in (1, 4):
+            payload = [{'item': item.pk, 'text': 'Nice'} for item in items[:size]]
+            with CaptureQueriesContext(connection) as context:
+                res = self.client.post(url, payload, format='json')
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            queries.append(len(context))
+        self.assertEqual(queries[0], queries[1])
+        self.assertEqual(Comment.objects.filter(user=self.user).count(), 5)
+
+        payload = [{'item': 0, 'text': 'Missing'}, {'item': 'abc', 'text': 'Bad'}, {'item': items[0].pk, 'text': 'Ok'}]
+        res = self.client.post(url, payload, format='json')
+        self.assertEqual([r['status'] for r in res.data['results']], [400, 400, 201])
+        self.assertEqual(res.data['results'][0]['errors']['item'][0].code, 'does_not_exist')
+        self.assertEqual(res.data['results'][1]['errors']['item'][0].code, 'incorrect_type')
+
+    def test_bulk_requires_list(self):
+        res = self.client.post(self.url, {'item_name': 'Soup'}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_requires_authentication(self):
+        self.client.force_authenticate(None)
+        res = self.client.post(self.url, [], format='json')
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class SparseFieldsTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(username='testuser', password='testpass')
+        self.item = create_item(user=self.user)
+        Comment.objects.create(item=self.item, user=self.user, text='Nice')
+
+    def test_fields_trim_output(self):
+        """Test only the requested fields are returned, relations as ids."""
+        res = self.client.get(ITEM_LIST_URL, {'fields': 'id,item_name,user_name,rating_average'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res.data['results'],
+            [{'id': self.item.pk, 'item_name': 'Sample Recipe', 'user_name': self.user.pk,
+              'rating_average': '0.000'}],
+        )
+
+    def test_expand_embeds_relation(self):
+        res = self.client.get(ITEM_DETAIL_URL(self.item.pk), {'fields': 'id,user_name', 'expand': 'user_name'})
+        self.assertEqual(res.data['user_name']['username'], 'testuser')
+
+    def test_fields_trim_queries(self):
+        """Test unrequested comments are neither counted nor prefetched."""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(ITEM_LIST_URL, {'fields': 'id,item_name'})
+        # the catalogue version, then the recipes
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn('food_comment', queries[1]['sql'])
+        self.assertNotIn('item_desc', queries[1]['sql'])
+
+    def test_comment_fields(self):
+        res = self.client.get(reverse('comment-list'), {'fields': 'id,user,text'})
+        self.assertEqual(res.data['results'], [{'id': Comment.objects.get().pk, 'user': self.user.pk, 'text': 'Nice'}])
+
+    def test_profile_fields(self):
+        res = self.client.get(reverse('profile-list'), {'fields': 'user,location', 'expand': 'user'})
+        self.assertEqual(res.data['results'][0]['user']['username'], 'testuser')
+        self.assertEqual(set(res.data['results'][0]), {'user', 'location'})
+
+    def test_no_parameters_return_everything(self):
+        res = self.client.get(ITEM_DETAIL_URL(self.item.pk))
+        self.assertEqual(res.data['user_name']['username'], 'testuser')
+        self.assertEqual(len(res.data['comments']), 1)
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, APITestCase):
+
+    def setUp(self):
+        call_command('seed_benchmark', users=3, items=0, comments=0, ratings=0, stdout=StringIO())
+        user = User.objects.filter(username__startswith='bench_').first()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+    def grow(self, size):
+        """Seed recipes with comments and profiles until there are ``size`` of each."""
+        items = max(size - Item.objects.count(), 0)
+        call_command(
+            'seed_benchmark', users=items, items=items, comments=items * 5, ratings=0, seed=size, stdout=StringIO(),
+        )
+
+    def test_list_budgets(self):
+        """Test the lists run the same queries whatever the page size."""
+        for name in ('item-list', 'comment-list', 'profile-list'):
+            with self.subTest(name):
+                self.assertQueryBudget(
+                    lambda size: self.client.get(reverse(name), {'page_size': size}), [1, 5, 20], grow=self.grow,
+                )
+
+    def test_detail_budgets(self):
+        """Test a recipe and its comments run the same queries however many comments there are."""
+        items = []
+
+        def grow(size):
+            call_command('seed_benchmark', users=1, items=1, comments=size, ratings=0, stdout=StringIO())
+            items.append(Item.objects.latest('id'))
+
+        for url in (ITEM_DETAIL_URL, lambda pk: reverse('item-comments', args=[pk])):
+            with self.subTest(url):
+                self.assertQueryBudget(lambda size: self.client.get(url(items[-1].pk)), [1, 10, 30], grow=grow)
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(username='testuser', password='testpass')
+        self.item = create_item(user=self.user, item_name='Soup')
+        Comment.objects.create(item=self.item, user=self.user, text='Nice')
+        self.url = reverse('item-export')
+
+    def _lines(self, res):
+        return b''.join(res.streaming_content).decode().splitlines()
+
+    def test_export_requires_authentication(self):
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_export_ndjson(self):
+        """Test items are streamed one JSON object per line."""
+        self.client.force_authenticate(self.user)
+        res = self.client.get(self.url)
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self._lines(res)]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['item_name'], 'Soup')
+        self.assertEqual(rows[0]['author'], 'testuser')
+        self.assertEqual(rows[0]['comment_count'], 1)
+        self.assertEqual(rows[0]['cooking_time'], '00:30:00')
+
+    def test_export_csv_since(self):
+        """Test the CSV export leaves out items not updated since the given date."""
+        self.client.force_authenticate(self.user)
+        Item.objects.filter(pk=self.item.pk).update(update_date=timezone.now() - timedelta(days=10))
+        create_item(user=self.user, item_name='Salad')
+        since = (timezone.now() - timedelta(days=1)).date().isoformat()
+        lines = self._lines(self.client.get(self.url, {'output': 'csv', 'since': since}))
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('id,item_name'))
+        self.assertIn('Salad', lines[1])
+
+    def test_export_invalid_since(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(self.url, {'since': 'yesterday'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_command(self):
+        out = StringIO()
+        call_command('export_recipes', format='csv', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
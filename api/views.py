@@ -3,28 +3,41 @@ from rest_framework import viewsets, permissions, generics, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from food.models import Item, Comment
+from food.fragments import catalogue_version, conditional_response, get_version, set_validators
 from users.models import Profile
 from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models import Count, Prefetch
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
+from food import export as food_export, signals as food_signals
 from .serializers import (
     ItemSerializer,
     CommentSerializer,
+    PrefetchedPrimaryKeyRelatedField,
     ProfileSerializer,
     UserSerializer,
     ProfileImageSerializer,
     UserSerializerWithToken,
+    latest_comments_limit,
 )
 
 from .permissions import IsOwnerOrReadOnly
+from .sparse import sparse_fields, trim_queryset
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from .authentication import CachedJWTAuthentication
 
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
     def validate(self, attrs):
         data = super().validate(attrs)
 
-        serializer = UserSerializerWithToken(self.user).data
+        # reuse the pair issued above instead of minting a second refresh token
+        context = {'tokens': {self.user.pk: (data['access'], data['refresh'])}}
+        serializer = UserSerializerWithToken(self.user, context=context).data
         for k, v in serializer.items():
             data[k] = v
 
@@ -34,17 +47,208 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
 class MyTokenObtainPairView(TokenObtainPairView):
     serializer_class = MyTokenObtainPairSerializer
 
+class ConditionalGetMixin:
+    """
+    Answer reads of unchanged recipes with 304 Not Modified.
+
+    The validators come from the change versions the items keep in the
+    database, see food/fragments.py, so a 304 costs one small query and no
+    serialization.
+    """
+
+    def conditional(self, request, tag, version, handler, *args, **kwargs):
+        if version is None:  # no such item - let the handler answer 404
+            return handler(request, *args, **kwargs)
+        # JSON and the browsable API share URLs, so the ETag depends on the format too
+        tag = f'{tag}-{request.accepted_renderer.format}'
+        not_modified = conditional_response(request, tag, version)
+        if not_modified is not None:
+            return not_modified
+        return set_validators(handler(request, *args, **kwargs), tag, version)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(request, self.basename, catalogue_version(), super().list, *args, **kwargs)
+
+
+class BulkMixin:
+    """
+    Create, update or delete many objects in one request, at ``<prefix>/bulk/``.
+
+    POST takes a list of new objects, PATCH a list of partial objects with
+    their ``id`` and DELETE a list of ids. Every entry is validated and
+    checked against the object permissions on its own, then all the valid
+    ones are written with one bulk_create(), bulk_update() or delete() in a
+    single transaction. The response has the outcome of each entry, in order;
+    it is 207 Multi-Status when any entry failed.
+
+    The objects the entries refer to through a PrefetchedPrimaryKeyRelatedField
+    are fetched in one query per field before the entries are validated.
+    """
+    owner_field = None
+
+    def get_bulk_queryset(self):
+        return self.queryset.model._default_manager.all()
+
+    def bulk_prepare(self, obj, fields):
+        """Called before each object is written, ``fields`` is None for new objects."""
+
+    def bulk_written(self, objs):
+        """Called with the created or updated objects, bulk writes send no signals."""
+
+    def has_bulk_permission(self, request, obj):
+        return all(
+            permission.has_object_permission(request, self, obj) for permission in self.get_permissions()
+        )
+
+    @action(methods=['POST', 'PATCH', 'DELETE'], detail=False, url_path='bulk')
+    def bulk(self, request):
+        entries = request.data
+        if not isinstance(entries, list):
+            return Response({'detail': 'Expected a list.'}, status=status.HTTP_400_BAD_REQUEST)
+        max_size = getattr(settings, 'API_BULK_MAX_SIZE', 500)
+        if len(entries) > max_size:
+            return Response(
+                {'detail': f'At most {max_size} entries per request.'}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        handler = {'POST': self._bulk_create, 'PATCH': self._bulk_update, 'DELETE': self._bulk_delete}
+        with transaction.atomic():
+            results = handler[request.method](request, entries)
+
+        failed = any(result['status'] >= 400 for result in results)
+        return Response({'results': results}, status=status.HTTP_207_MULTI_STATUS if failed else status.HTTP_200_OK)
+
+    def _bulk_context(self, entries):
+        """Serializer context with the related objects of every entry, see PrefetchedPrimaryKeyRelatedField."""
+        context = self.get_serializer_context()
+        related = context['related_objects'] = {}
+        for name, field in self.get_serializer().fields.items():
+            if field.read_only or not isinstance(field, PrefetchedPrimaryKeyRelatedField):
+                continue
+            pk_field = field.get_queryset().model._meta.pk
+            pks = set()
+            for entry in entries:
+                if isinstance(entry, dict) and not isinstance(entry.get(name), (bool, type(None))):
+                    try:
+                        pks.add(pk_field.to_python(entry[name]))
+                    except DjangoValidationError:
+                        pass  # reported by the field
+            related[name] = field.get_queryset().in_bulk(pks)
+        return context
+
+    def _bulk_create(self, request, entries):
+        results, created = [], []
+        context = self._bulk_context(entries)
+        for index, entry in enumerate(entries):
+            serializer = self.get_serializer(data=entry, context=context)
+            if not serializer.is_valid():
+                results.append({'index': index, 'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors})
+                continue
+            obj = self.queryset.model(**serializer.validated_data, **{self.owner_field: request.user})
+            if not self.has_bulk_permission(request, obj):
+                results.append({'index': index, 'status': status.HTTP_403_FORBIDDEN})
+                continue
+            self.bulk_prepare(obj, None)
+            results.append({'index': index, 'status': status.HTTP_201_CREATED})
+            created.append((obj, results[-1]))
+
+        objs = self.queryset.model._default_manager.bulk_create([obj for obj, _ in created])
+        for obj, (_, result) in zip(objs, created):
+            result['id'] = obj.pk
+        self.bulk_written(objs)
+        return results
+
+    def _entry_ids(self, entries):
+        ids = []
+        for entry in entries:
+            value = entry.get('id') if isinstance(entry, dict) else entry
+            try:
+                ids.append(int(value))
+            except (TypeError, ValueError):
+                ids.append(None)
+        return ids
+
+    def _bulk_update(self, request, entries):
+        ids = self._entry_ids(entries)
+        objects = self.get_bulk_queryset().in_bulk([pk for pk in ids if pk is not None])
+        auto_now = [field for field in self.queryset.model._meta.concrete_fields if getattr(field, 'auto_now', False)]
+        results, updated, fields = [], {}, set()
+        context = self._bulk_context(entries)
+        for index, (pk, entry) in enumerate(zip(ids, entries)):
+            if pk is None or not isinstance(entry, dict):
+                errors = {'id': ['This field is required.']}
+                results.append({'index': index, 'status': status.HTTP_400_BAD_REQUEST, 'errors': errors})
+                continue
+            obj = objects.get(pk)
+            if obj is None:
+                results.append({'index': index, 'id': pk, 'status': status.HTTP_404_NOT_FOUND})
+                continue
+            if not self.has_bulk_permission(request, obj):
+                results.append({'index': index, 'id': pk, 'status': status.HTTP_403_FORBIDDEN})
+                continue
+            serializer = self.get_serializer(obj, data=entry, partial=True, context=context)
+            if not serializer.is_valid():
+                results.append(
+                    {'index': index, 'id': pk, 'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors}
+                )
+                continue
+            changed = set(serializer.validated_data)
+            for attr, value in serializer.validated_data.items():
+                setattr(obj, attr, value)
+            # bulk_update() does not call pre_save(), so auto_now fields are set here
+            for field in auto_now:
+                setattr(obj, field.attname, timezone.now())
+                changed.add(field.name)
+            self.bulk_prepare(obj, changed)
+            fields |= changed
+            updated[pk] = obj
+            results.append({'index': index, 'id': pk, 'status': status.HTTP_200_OK})
+
+        if updated and fields:
+            self.queryset.model._default_manager.bulk_update(list(updated.values()), fields)
+        self.bulk_written(list(updated.values()))
+        return results
+
+    def _bulk_delete(self, request, entries):
+        ids = self._entry_ids(entries)
+        objects = self.get_bulk_queryset().in_bulk([pk for pk in ids if pk is not None])
+        results, deleted = [], set()
+        for index, pk in enumerate(ids):
+            obj = objects.get(pk)
+            if pk is None:
+                errors = {'id': ['This field is required.']}
+                results.append({'index': index, 'status': status.HTTP_400_BAD_REQUEST, 'errors': errors})
+            elif obj is None:
+                results.append({'index': index, 'id': pk, 'status': status.HTTP_404_NOT_FOUND})
+            elif not self.has_bulk_permission(request, obj):
+                results.append({'index': index, 'id': pk, 'status': status.HTTP_403_FORBIDDEN})
+            else:
+                deleted.add(pk)
+                results.append({'index': index, 'id': pk, 'status': status.HTTP_204_NO_CONTENT})
+        # A queryset delete still sends the delete signals for each object
+        self.get_bulk_queryset().filter(pk__in=deleted).delete()
+        return results
+
+
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    ordering = ('id',)
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
 
 class ProfileViewSet(viewsets.ModelViewSet):
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
+    ordering = ('id',)
+    query_budgets = {'list': 2, 'retrieve': 2}
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
+
+    def get_queryset(self):
+        sparse = sparse_fields(self.request)
+        related = ['user'] if sparse.expands('user') else []
+        return trim_queryset(super().get_queryset(), ProfileSerializer, sparse, self.ordering, related)
 
     def get_serializer_class(self):
         """Return the serializer class for request."""
@@ -68,20 +272,110 @@ class ProfileViewSet(viewsets.ModelViewSet):
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class ItemViewSet(viewsets.ModelViewSet):
+class ItemViewSet(ConditionalGetMixin, BulkMixin, viewsets.ModelViewSet):
     queryset = Item.objects.all()
     serializer_class = ItemSerializer
+    ordering = ('-rating_average', 'id')
+    owner_field = 'user_name'
+    # authenticated user, the version, the recipes and their latest comments - whatever the page size
+    query_budgets = {'list': 4, 'retrieve': 4, 'comments': 3}
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
+
+    def get_queryset(self):
+        """Load authors, comment counts and the latest comments in bulk, if they were asked for."""
+        sparse = sparse_fields(self.request)
+        related = []
+        if sparse.expands('user_name'):
+            related.append('user_name')
+        if sparse.includes('image_url'):
+            related.append('image_asset')
+        queryset = trim_queryset(super().get_queryset(), ItemSerializer, sparse, self.ordering, related)
+        if sparse.fields is None and self.request.method in permissions.SAFE_METHODS:
+            # reads never return the raw description, lists not the HTML either
+            deferred = ['item_desc', 'item_desc_text'] + (['item_desc_html'] if self.action == 'list' else [])
+            queryset = queryset.defer(*deferred)
+        if sparse.includes('comment_count'):
+            queryset = queryset.annotate(comment_count=Count('comments'))
+        if sparse.includes('comments'):
+            latest_comments = Comment.objects.select_related('user').order_by('-created_at', '-id')
+            queryset = queryset.prefetch_related(
+                Prefetch('comments', queryset=latest_comments[:latest_comments_limit()], to_attr='latest_comments')
+            )
+        return queryset
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs['pk']
+        return self.conditional(request, f'item-{pk}', get_version(pk), super().retrieve, *args, **kwargs)
 
     def perform_create(self, serializer):
         serializer.save(user_name=self.request.user)
 
-class CommentViewSet(viewsets.ModelViewSet):
+    def get_bulk_queryset(self):
+        # the search index needs the author, the image copy the current asset
+        return Item.objects.select_related('user_name', 'image_asset')
+
+    def bulk_prepare(self, item, fields):
+        if fields is None or 'item_desc' in fields:
+            item.sanitize_desc()
+            if fields is not None:
+                fields.update(Item.SANITIZED_FIELDS)
+
+    def bulk_written(self, items):
+        # up to API_BULK_MAX_SIZE images - left to the ingest_recipe_images command
+        food_signals.sync_items(items)
+
+    @action(methods=['GET'], detail=False, permission_classes=[permissions.IsAuthenticated])
+    def export(self, request):
+        """Stream the whole catalogue as NDJSON or CSV (?output=csv), optionally only ?since= a date."""
+        fmt = request.query_params.get('output', 'ndjson')
+        if fmt not in food_export.FORMATS:
+            return Response({'output': [f'Must be one of {", ".join(food_export.FORMATS)}.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        since = request.query_params.get('since')
+        if since is not None:
+            since = food_export.parse_since(since)
+            if since is None:
+                return Response({'since': ['Must be an ISO date or datetime.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        _, content_type = food_export.FORMATS[fmt]
+        response = StreamingHttpResponse(food_export.export(fmt, since), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="recipes.{fmt}"'
+        return response
+
+    @action(methods=['GET'], detail=True, ordering=('-created_at', '-id'))
+    def comments(self, request, pk=None):
+        """List all comments of a recipe, newest first, one page at a time."""
+        version = get_version(pk)
+        if version is None:
+            raise Http404
+        return self.conditional(request, f'item-{pk}-comments', version, self._list_comments, pk)
+
+    def _list_comments(self, request, pk):
+        sparse = sparse_fields(request)
+        related = ['user'] if sparse.expands('user') else []
+        comments = trim_queryset(Comment.objects.filter(item_id=pk), CommentSerializer, sparse, self.ordering, related)
+        page = self.paginate_queryset(comments)
+        serializer = CommentSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+class CommentViewSet(ConditionalGetMixin, BulkMixin, viewsets.ModelViewSet):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
+    ordering = ('-created_at', '-id')
+    owner_field = 'user'
+    # authenticated user, the catalogue version and the comments
+    query_budgets = {'list': 3, 'retrieve': 2}
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
+
+    def get_queryset(self):
+        sparse = sparse_fields(self.request)
+        related = ['user'] if sparse.expands('user') else []
+        return trim_queryset(super().get_queryset(), CommentSerializer, sparse, self.ordering, related)
+
+    def bulk_written(self, comments):
+        food_signals.sync_comments(comments)
 
 
 class RegisterApiView(generics.CreateAPIView):
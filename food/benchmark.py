@@ -0,0 +1,65 @@
+"""
+Helpers for the benchmark commands: timing of operations and their summary.
+"""
+import math
+import time
+
+# Text of the comments written by the benchmarks, removed when they finish
+BENCHMARK_TEXT = '[benchmark]'
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+class Timings:
+    """Latencies and errors of one kind of operation."""
+
+    def __init__(self):
+        self.latencies = []
+        self.queries = []
+        self.errors = 0
+
+    def add(self, latency, queries=None):
+        self.latencies.append(latency)
+        if queries is not None:
+            self.queries.append(queries)
+
+    def time(self, operation, errors=(Exception,)):
+        started = time.perf_counter()
+        try:
+            operation()
+        except errors:
+            self.errors += 1
+            return False
+        self.latencies.append(time.perf_counter() - started)
+        return True
+
+    def merge(self, other):
+        self.latencies.extend(other.latencies)
+        self.queries.extend(other.queries)
+        self.errors += other.errors
+
+    def summary(self, elapsed):
+        """Counts, rate per second and p50/p95/p99 latency in milliseconds."""
+        latencies = sorted(self.latencies)
+
+        def ms(value):
+            return None if value is None else round(value * 1000, 3)
+
+        summary = {
+            'count': len(latencies),
+            'errors': self.errors,
+            'per_second': round(len(latencies) / elapsed, 1) if elapsed else None,
+            'p50_ms': ms(percentile(latencies, 0.50)),
+            'p95_ms': ms(percentile(latencies, 0.95)),
+            'p99_ms': ms(percentile(latencies, 0.99)),
+        }
+        if self.queries:
+            summary['queries_per_request'] = round(sum(self.queries) / len(self.queries), 2)
+        return summary
+
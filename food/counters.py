@@ -0,0 +1,196 @@
+"""
+Write-behind view counter for recipe detail pages.
+
+Page views are buffered in the cache instead of saving the whole Item row on
+every GET, and written back in batches with atomic ``F('views') + n`` updates.
+
+Each worker writes the views it buffered after VIEW_COUNT_FLUSH_THRESHOLD
+views, every VIEW_COUNT_FLUSH_INTERVAL seconds from a background thread,
+and when it exits (see mysite/wsgi.py). The ids with buffered views are
+also logged in the cache, so the ``flush_view_counts`` command can write
+them from another process - that needs VIEW_COUNT_CACHE_ALIAS to be a cache
+shared by all processes, such as Redis or Memcached. With the default local
+memory cache every worker only sees its own buffer.
+
+A flush claims an item's views while holding a lock key taken with
+``cache.add()``, so two flushes never write the same views - also on
+Memcached, whose ``decr()`` stops at zero.
+"""
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.models import F
+
+from .models import Item
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'food:views:'
+# Seconds a flush may hold an item's lock - it expires if the process dies holding it
+LOCK_TIMEOUT = 60
+# Numbered log of the ids with buffered views: the last number used, the last one flushed, and one key per entry
+LOG_KEY = 'food:views-log'
+LOG_FLUSHED_KEY = 'food:views-log:flushed'
+LOG_TIMEOUT = 24 * 60 * 60
+
+
+def _key(pk):
+    return f'{KEY_PREFIX}{pk}'
+
+
+class ViewCounter:
+    """Buffer item view increments and flush them to the database in batches."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._recorded = 0
+        self._last_flush = time.monotonic()
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'VIEW_COUNT_CACHE_ALIAS', 'default')]
+
+    @property
+    def threshold(self):
+        return getattr(settings, 'VIEW_COUNT_FLUSH_THRESHOLD', 50)
+
+    @property
+    def interval(self):
+        return getattr(settings, 'VIEW_COUNT_FLUSH_INTERVAL', 30)
+
+    def record(self, pk):
+        """
+        Count one view of the item and flush when the buffer is due.
+
+        Returns the number of views buffered for the item before any flush.
+        """
+        key = _key(pk)
+        self.cache.add(key, 0, timeout=None)
+        try:
+            pending = self.cache.incr(key)
+        except ValueError:
+            # The key was evicted between add() and incr().
+            pending = 1
+            self.cache.set(key, pending, timeout=None)
+
+        with self._lock:
+            new = pk not in self._dirty
+            self._dirty.add(pk)
+            self._recorded += 1
+            due = (
+                self._recorded >= self.threshold
+                or time.monotonic() - self._last_flush >= self.interval
+            )
+        if new:
+            self._log(pk)
+        if due:
+            self.flush()
+        return pending
+
+    def _log(self, pk):
+        """Add the id to the log read by flush_logged(), once per flush of this worker."""
+        self.cache.add(LOG_KEY, 0, timeout=None)
+        try:
+            number = self.cache.incr(LOG_KEY)
+        except ValueError:
+            return  # evicted meanwhile - this worker still flushes the views itself
+        self.cache.set(f'{LOG_KEY}:{number}', pk, timeout=LOG_TIMEOUT)
+
+    def flush_logged(self, chunk_size=500):
+        """
+        Write the buffered views of every id in the log, whichever worker recorded them.
+
+        Returns the number of views written.
+        """
+        last = self.cache.get(LOG_KEY) or 0
+        start = (self.cache.get(LOG_FLUSHED_KEY) or 0) + 1
+        written = 0
+        for chunk_start in range(start, last + 1, chunk_size):
+            keys = [f'{LOG_KEY}:{number}' for number in range(chunk_start, min(chunk_start + chunk_size, last + 1))]
+            written += self.flush(set(self.cache.get_many(keys).values()))
+            self.cache.delete_many(keys)
+        self.cache.set(LOG_FLUSHED_KEY, last, timeout=None)
+        return written
+
+    def pending(self, pk):
+        """Return the number of buffered views not yet written for the item."""
+        return self.cache.get(_key(pk)) or 0
+
+    def flush(self, pks=None):
+        """
+        Write buffered views to the database.
+
+        Flushes the ids this worker has seen, or ``pks`` when given.
+        Returns the number of views written.
+        """
+        with self._lock:
+            if pks is None:
+                pks, self._dirty = self._dirty, set()
+            else:
+                pks = set(pks)
+                self._dirty -= pks
+            self._recorded = 0
+            self._last_flush = time.monotonic()
+
+        if not pks:
+            return 0
+
+        keys = {_key(pk): pk for pk in pks}
+        written = 0
+        for key, count in self.cache.get_many(keys).items():
+            if count:
+                written += self._claim(key, keys[key])
+        return written
+
+    def _claim(self, key, pk):
+        """Write the buffered views of one item, unless another flush is writing them."""
+        lock = f'{key}:lock'
+        if not self.cache.add(lock, 1, timeout=LOCK_TIMEOUT):
+            # Views recorded after the other flush read the counter stay buffered, keep the id for the next flush.
+            with self._lock:
+                self._dirty.add(pk)
+            return 0
+        try:
+            count = self.cache.get(key)
+            if not count:
+                return 0
+            # Increments recorded meanwhile stay buffered for the next flush.
+            try:
+                self.cache.decr(key, count)
+            except ValueError:
+                pass  # evicted - the views read above are still written
+            Item.objects.filter(pk=pk).update(views=F('views') + count)
+            return count
+        finally:
+            self.cache.delete(lock)
+
+    def start(self):
+        """Flush every VIEW_COUNT_FLUSH_INTERVAL seconds in a background thread, also when no views come in."""
+        self._start_thread()
+        # Threads do not survive a fork, e.g. of the workers of gunicorn --preload. Windows has no fork.
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._start_thread)
+
+    def _start_thread(self):
+        threading.Thread(target=self._flush_periodically, name='view-counter', daemon=True).start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.interval)
+            if time.monotonic() - self._last_flush < self.interval:
+                continue  # record() flushed meanwhile
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not write the buffered recipe views')
+            finally:
+                # this thread's connections, not those of the requests
+                connections.close_all()
+
+view_counter = ViewCounter()
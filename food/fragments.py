@@ -0,0 +1,96 @@
+"""
+Change versions of recipes.
+
+Every item stores the time of its last change in ``change_date``: saving the
+item sets it, and the signals touch it whenever one of its comments or its
+rating changes. ``Item.cache_version`` turns it into a number. The recipe
+templates put it in their ``{% cache %}`` keys, so stale fragments are never
+read again, and the views derive ETag and Last-Modified validators from it.
+
+The versions live in the database rather than in the cache: the default
+cache is local to each worker, so a version bumped there would never reach
+the other workers, which would keep serving stale fragments and 304s.
+
+The catalogue version, which validates the list pages, is the latest
+change to any item. A deleted item leaves no change behind, so the
+deletions are recorded in ``ItemDeletion``, one row per author, and count
+as changes too. Authors have a version of their own, made the same way from
+their items, for the recipe list on their profile page. Each version is a
+single indexed MAX, however many items there are.
+"""
+from datetime import timedelta
+
+from django.db.models import DateTimeField, Max, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .models import EPOCH, Item, ItemDeletion
+
+
+def bump_version(pk):
+    """Invalidate the cached fragments and validators of an item."""
+    bump_versions([pk])
+
+
+def bump_versions(pks):
+    """Invalidate several items at once."""
+    Item.objects.filter(pk__in=pks).update(change_date=timezone.now())
+
+
+def get_version(pk):
+    """Return the version of an item, None if there is no such item."""
+    item = Item.objects.filter(pk=pk).only('change_date').first()
+    return item.cache_version if item is not None else None
+
+
+def _latest_version(items, deletions):
+    epoch = Value(EPOCH, output_field=DateTimeField())
+    deleted = deletions.order_by('-deleted_at').values('deleted_at')[:1]
+    latest = items.order_by().aggregate(
+        latest=Greatest(Coalesce(Max('change_date'), epoch), Coalesce(Subquery(deleted), epoch)),
+    )['latest']
+    return (latest - EPOCH) // timedelta(microseconds=1)
+
+
+def catalogue_version():
+    """Return the version of the most recent change to any item."""
+    return _latest_version(Item.objects.all(), ItemDeletion.objects.all())
+
+
+def author_version(user_id):
+    """Return the version of the most recent change to an author's items."""
+    return _latest_version(Item.objects.filter(user_name_id=user_id), ItemDeletion.objects.filter(user_id=user_id))
+
+
+def record_deletion(user_id):
+    """Make a deleted item change the catalogue version and its author's."""
+    ItemDeletion.objects.update_or_create(user_id=user_id, defaults={'deleted_at': timezone.now()})
+
+
+def _timestamp(version):
+    """Return the time in seconds of the change a version stands for."""
+    return version // 1_000_000
+
+
+def conditional_response(request, tag, version):
+    """
+    Return a 304 response when the client already has this version, else None.
+
+    ``tag`` names what the version applies to, e.g. the item and the user the
+    page was rendered for.
+    """
+    return get_conditional_response(
+        request,
+        etag=quote_etag(f'{tag}-{version}'),
+        last_modified=_timestamp(version),
+    )
+
+
+def set_validators(response, tag, version):
+    """Add the ETag and Last-Modified headers for a version to a response."""
+    if response.status_code == 200:
+        response.headers.setdefault('ETag', quote_etag(f'{tag}-{version}'))
+        response.headers.setdefault('Last-Modified', http_date(_timestamp(version)))
+    return response
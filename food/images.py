@@ -0,0 +1,236 @@
+"""
+Local, content-addressed copies of recipe images.
+
+``Item.item_image`` is a URL, usually on a third-party CDN. After an item is
+saved its image is fetched once, stored under the SHA-256 of its content and
+resized, so the pages serve it from MEDIA_URL. A URL already fetched is not
+fetched again, and the same picture behind different URLs is stored once.
+
+The URLs come from users, so ``HttpFetcher`` only connects to public
+addresses: every address a host resolves to is checked, on every redirect,
+and the connection goes to the address that was checked. Downloads never
+run in a request - saved items are queued for a background thread of the
+worker (see mysite/wsgi.py), and the ``ingest_recipe_images`` command
+copies whatever is left.
+"""
+import hashlib
+import http.client
+import ipaddress
+import logging
+import os
+import queue
+import socket
+import threading
+import urllib.request
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from PIL import Image, ImageOps
+
+from users.images import FORMATS
+from .models import ImageAsset, Item
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+# Images waiting for the background thread - more are left to the ingest_recipe_images command
+QUEUE_SIZE = 1000
+
+
+class FetchError(Exception):
+    pass
+
+
+def _check_address(host, address):
+    ip = ipaddress.ip_address(address.split('%')[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    # private, loopback, link-local (the cloud metadata service), shared and reserved addresses are not global
+    if not ip.is_global or ip.is_multicast:
+        raise FetchError(f'Not a public address: {host} is {ip}')
+
+
+def _connect_public(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    """socket.create_connection() that only connects to public addresses, and to the ones it checked."""
+    host, port = address
+    infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    for *_, sockaddr in infos:
+        _check_address(host, sockaddr[0])
+    error = OSError(f'No address for {host}')
+    for *_, sockaddr in infos:
+        try:
+            return socket.create_connection((sockaddr[0], port), timeout, source_address)
+        except OSError as e:
+            error = e
+    raise error
+
+
+class _PublicConnectionMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPConnection(_PublicConnectionMixin, http.client.HTTPConnection):
+    pass
+
+
+class _PublicHTTPSConnection(_PublicConnectionMixin, http.client.HTTPSConnection):
+    pass
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req, context=self._context)
+
+
+def _build_opener():
+    # No proxy, FTP or file handlers - redirects can only lead to other public HTTP(S) URLs
+    opener = urllib.request.OpenerDirector()
+    for handler in (
+        _PublicHTTPHandler(),
+        _PublicHTTPSHandler(),
+        urllib.request.HTTPRedirectHandler(),
+        urllib.request.HTTPDefaultErrorHandler(),
+        urllib.request.HTTPErrorProcessor(),
+    ):
+        opener.add_handler(handler)
+    return opener
+
+
+class HttpFetcher:
+    """Download an image over HTTP(S) from a public address."""
+    timeout = 5
+
+    def __call__(self, url):
+        if not url.startswith(('http://', 'https://')):
+            raise FetchError(f'Not an HTTP URL: {url}')
+        max_bytes = settings.RECIPE_IMAGE_MAX_BYTES
+        request = urllib.request.Request(url, headers={'User-Agent': 'djangoFoodApp'})
+        try:
+            with _build_opener().open(request, timeout=self.timeout) as response:
+                data = response.read(max_bytes + 1)
+        except (OSError, ValueError) as e:
+            raise FetchError(f'Could not fetch {url}: {e}')
+        if len(data) > max_bytes:
+            raise FetchError(f'Image too large: {url}')
+        return data
+
+
+def get_fetcher():
+    return import_string(settings.RECIPE_IMAGE_FETCHER)()
+
+
+def _store(name, data):
+    # Same content, same name - a file that is already there is the same image
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(data))
+
+
+def store_image(url, data):
+    """Store fetched image bytes under their hash, with their variants. Returns the ImageAsset."""
+    try:
+        with Image.open(BytesIO(data)) as original:
+            extension = EXTENSIONS.get(original.format)
+            if extension is None:
+                raise FetchError(f'Unsupported image format {original.format}: {url}')
+            picture = ImageOps.exif_transpose(original).convert('RGB')
+    except Image.DecompressionBombError as e:
+        raise FetchError(f'Image too large: {url}: {e}')
+    except OSError as e:
+        raise FetchError(f'Not an image: {url}: {e}')
+
+    asset = ImageAsset(source_url=url, digest=hashlib.sha256(data).hexdigest(), extension=extension)
+    _store(asset.file_name, data)
+    for size in settings.RECIPE_IMAGE_SIZES:
+        for fmt, (_, options) in FORMATS.items():
+            name = asset.variant_name(size, fmt)
+            if default_storage.exists(name):
+                continue
+            buffer = BytesIO()
+            ImageOps.fit(picture, (size, size), Image.Resampling.LANCZOS).save(buffer, **options)
+            _store(name, buffer.getvalue())
+
+    try:
+        with transaction.atomic():
+            asset.save()
+    except IntegrityError:
+        # Another worker stored the same URL meanwhile
+        asset = ImageAsset.objects.get(source_url=url)
+    return asset
+
+
+def ingest(pk, url):
+    """Point an item at the local copy of ``url``, fetching it if it is new."""
+    asset = ImageAsset.objects.filter(source_url=url).first()
+    if asset is None:
+        try:
+            asset = store_image(url, get_fetcher()(url))
+        except FetchError as e:
+            logger.warning('Keeping remote recipe image: %s', e)
+            return None
+    # Only if the item still shows this URL - it may have been edited meanwhile
+    Item.objects.filter(pk=pk, item_image=url).update(image_asset=asset, change_date=timezone.now())
+    return asset
+
+
+class IngestQueue:
+    """Run ingest() for saved items in a background thread, one image at a time."""
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+
+    def put(self, pk, url):
+        try:
+            self._queue.put_nowait((pk, url))
+        except queue.Full:
+            logger.warning('Recipe image queue full, leaving %s to ingest_recipe_images', url)
+
+    def drain(self):
+        """Ingest the queued images in this thread. Returns how many were queued."""
+        count = 0
+        while True:
+            try:
+                pk, url = self._queue.get_nowait()
+            except queue.Empty:
+                return count
+            ingest(pk, url)
+            count += 1
+
+    def start(self):
+        """Ingest queued images in a background thread of this process."""
+        self._start_thread()
+        # Threads do not survive a fork, and the queue's locks may be held by one that did not. Windows has no fork.
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._restart)
+
+    def _restart(self):
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        self._start_thread()
+
+    def _start_thread(self):
+        threading.Thread(target=self._ingest_forever, name='recipe-images', daemon=True).start()
+
+    def _ingest_forever(self):
+        while True:
+            pk, url = self._queue.get()
+            try:
+                ingest(pk, url)
+            except Exception:
+                logger.exception('Could not copy recipe image %s', url)
+            finally:
+                # this thread's connections, not those of the requests
+                connections.close_all()
+
+
+ingest_queue = IngestQueue()
@@ -0,0 +1,81 @@
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+
+from food.benchmark import BENCHMARK_TEXT, Timings
+from food.models import Comment, Item
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure concurrent reads and writes against the configured database profile. '
+        'Run it once per DATABASE_PROFILE to compare them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4, help='Threads running the recipe list query.')
+        parser.add_argument('--writers', type=int, default=2, help='Threads adding comments.')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds to run for.')
+
+    def handle(self, *args, **options):
+        item_ids = list(Item.objects.order_by('-rating_average', 'id').values_list('pk', flat=True)[:100])
+        user = User.objects.order_by('pk').first()
+        if not item_ids or user is None:
+            raise CommandError('The benchmark needs at least one user and one recipe in the database.')
+
+        stop = threading.Event()
+        reads, writes = Timings(), Timings()
+        lock = threading.Lock()
+
+        def read():
+            # the query behind the first page of the recipe list
+            list(Item.objects.select_related('user_name').defer('item_desc', 'item_desc_html', 'item_desc_text')
+                 .order_by('-rating_average', 'id')[:20])
+
+        def write(n):
+            # a transaction that reads before it writes, like posting a comment
+            def operation():
+                with transaction.atomic():
+                    item = Item.objects.only('pk').get(pk=item_ids[n % len(item_ids)])
+                    Comment.objects.create(item=item, user=user, text=BENCHMARK_TEXT)
+            return operation
+
+        def worker(timings, make_operation):
+            local = Timings()
+            n = 0
+            try:
+                while not stop.is_set():
+                    local.time(make_operation(n), errors=(DatabaseError,))
+                    n += 1
+            finally:
+                connection.close()
+                with lock:
+                    timings.merge(local)
+
+        threads = [threading.Thread(target=worker, args=(reads, lambda n: read)) for _ in range(options['readers'])]
+        threads += [threading.Thread(target=worker, args=(writes, write)) for _ in range(options['writers'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(options['duration'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        Comment.objects.filter(text=BENCHMARK_TEXT, user=user).delete()
+        result = {
+            'profile': getattr(settings, 'DATABASE_PROFILE', None),
+            'engine': connection.settings_dict['ENGINE'],
+            'readers': options['readers'],
+            'writers': options['writers'],
+            'seconds': round(elapsed, 2),
+            'reads': reads.summary(elapsed),
+            'writes': writes.summary(elapsed),
+        }
+        self.stdout.write(json.dumps(result, indent=2))
@@ -0,0 +1,142 @@
+import json
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from food.benchmark import BENCHMARK_TEXT, Timings
+from food.models import Comment, Item
+from mysite.queries import QueryCounter
+from .seed_benchmark import USERNAME_PREFIX, WORDS, zipf_weights
+
+# How often each path is requested, relative to the others
+MIX = {
+    'index': 30,
+    'search': 15,
+    'detail': 25,
+    'api_items': 15,
+    'comment': 10,
+    'token': 5,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the main pages and API endpoints from concurrent in-process clients and report latency '
+        'percentiles, requests per second and queries per request as JSON. Run seed_benchmark first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--duration', type=float, default=10, help='Seconds to run for.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--password', default='benchmark', help='Password of the seeded users.')
+        parser.add_argument('--paths', default=','.join(MIX), help=f'Paths to request, out of {", ".join(MIX)}.')
+        parser.add_argument('--output', help='Also write the report to this file.')
+
+    def handle(self, *args, **options):
+        paths = [path.strip() for path in options['paths'].split(',') if path.strip()]
+        unknown = set(paths) - set(MIX)
+        if unknown:
+            raise CommandError(f'Unknown paths: {", ".join(sorted(unknown))}')
+        self.password = options['password']
+        self.users = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('pk')[:100])
+        # most popular recipes first, so the skewed choice below favours them
+        self.item_ids = list(Item.objects.order_by('-views', 'id').values_list('pk', flat=True)[:1000])
+        if not self.users or not self.item_ids:
+            raise CommandError('No benchmark data, run seed_benchmark first.')
+        self.item_weights = zipf_weights(len(self.item_ids), 1.1)
+
+        timings = {path: Timings() for path in paths}
+        lock = threading.Lock()
+        stop = threading.Event()
+        weights = [MIX[path] for path in paths]
+
+        def worker(number):
+            rng = random.Random(options['seed'] + number)
+            anonymous = Client(HTTP_HOST='localhost')
+            member = Client(HTTP_HOST='localhost')
+            member.force_login(self.users[number % len(self.users)])
+            local = {path: Timings() for path in paths}
+            counter = QueryCounter()
+            try:
+                with connection.execute_wrapper(counter):
+                    while not stop.is_set():
+                        path = rng.choices(paths, weights=weights)[0]
+                        counter.count = 0
+                        started = time.perf_counter()
+                        try:
+                            ok = getattr(self, f'request_{path}')(rng, anonymous, member)
+                        except Exception:
+                            ok = False
+                        if ok:
+                            local[path].add(time.perf_counter() - started, counter.count)
+                        else:
+                            local[path].errors += 1
+            finally:
+                connection.close()
+                with lock:
+                    for path, timing in local.items():
+                        timings[path].merge(timing)
+
+        threads = [threading.Thread(target=worker, args=(number,)) for number in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(options['duration'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        Comment.objects.filter(text=BENCHMARK_TEXT).delete()
+        total = Timings()
+        for timing in timings.values():
+            total.merge(timing)
+        report = {
+            'database': getattr(settings, 'DATABASE_PROFILE', connection.vendor),
+            'dataset': {
+                'users': User.objects.count(),
+                'items': Item.objects.count(),
+                'comments': Comment.objects.count(),
+            },
+            'threads': options['threads'],
+            'seconds': round(elapsed, 2),
+            'total': total.summary(elapsed),
+            'paths': {path: timing.summary(elapsed) for path, timing in timings.items()},
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output + '\n')
+        self.stdout.write(output)
+
+    def pick_item(self, rng):
+        return rng.choices(self.item_ids, cum_weights=self.item_weights)[0]
+
+    def request_index(self, rng, anonymous, member):
+        return anonymous.get(reverse('food:index')).status_code == 200
+
+    def request_search(self, rng, anonymous, member):
+        return anonymous.get(reverse('food:index'), {'q': rng.choice(WORDS)}).status_code == 200
+
+    def request_detail(self, rng, anonymous, member):
+        return anonymous.get(reverse('food:detail', args=[self.pick_item(rng)])).status_code == 200
+
+    def request_api_items(self, rng, anonymous, member):
+        return anonymous.get(reverse('item-list')).status_code == 200
+
+    def request_comment(self, rng, anonymous, member):
+        url = reverse('food:detail', args=[self.pick_item(rng)])
+        return member.post(url, {'text': BENCHMARK_TEXT}).status_code in (200, 302)
+
+    def request_token(self, rng, anonymous, member):
+        user = rng.choice(self.users)
+        response = anonymous.post(reverse('token_obtain_pair'), {'username': user.username, 'password': self.password})
+        return response.status_code == 200
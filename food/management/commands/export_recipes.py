@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from food.export import CHUNK_SIZE, FORMATS, export, parse_since
+
+
+class Command(BaseCommand):
+    help = 'Export the recipe catalogue as NDJSON or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), default='ndjson')
+        parser.add_argument('--since', help='Only recipes updated at or after this ISO date or datetime.')
+        parser.add_argument('--output', help='File to write to, standard output by default.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help='Number of rows fetched from the database at once.',
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_since(options['since'])
+            if since is None:
+                raise CommandError(f"Invalid --since: {options['since']}")
+
+        lines = export(options['format'], since, options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from food.counters import view_counter
+from mysite.caches import is_shared
+
+
+class Command(BaseCommand):
+    help = (
+        'Write the recipe views buffered by every worker to the database. Needs VIEW_COUNT_CACHE_ALIAS '
+        'to be a cache shared by the workers and this command.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Number of logged item ids to look up in the cache at once.',
+        )
+
+    def handle(self, *args, **options):
+        if not is_shared(view_counter.cache):
+            self.stderr.write(self.style.WARNING(
+                'The view counter cache is local to each process - only views buffered by this process are seen. '
+                'The workers write their own views, at the latest when they exit.'
+            ))
+        written = view_counter.flush_logged(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Flushed {written} views.'))
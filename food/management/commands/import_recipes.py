@@ -0,0 +1,137 @@
+import csv
+import json
+import os
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from food.forms import ItemForm
+from food.models import Item
+from food.signals import sync_items
+
+
+class ImportForm(ItemForm):
+    """ItemForm, plus the original publish date when there is one."""
+
+    class Meta(ItemForm.Meta):
+        fields = ItemForm.Meta.fields + ['publish_date']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['publish_date'].required = False
+
+
+def read_jsonl(file):
+    for line in file:
+        line = line.strip()
+        if not line:
+            yield None
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield {'__error__': f'Invalid JSON: {e}'}
+            continue
+        yield row if isinstance(row, dict) else {'__error__': 'Expected a JSON object'}
+
+
+def read_csv(file):
+    yield from csv.DictReader(file)
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv}
+
+
+class Command(BaseCommand):
+    help = 'Import recipes from a JSONL or CSV file, validated like ItemForm and written in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='JSONL or CSV file with one recipe per row.')
+        parser.add_argument('--format', choices=sorted(READERS), help='Taken from the file extension by default.')
+        parser.add_argument('--author', help='Username for rows without an "author" column.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per transaction.')
+        parser.add_argument('--rejects', help='Write the rejected rows with their errors to this JSONL file.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if fmt not in READERS:
+            raise CommandError(f'Unknown format {fmt!r}, use --format.')
+        self.verbosity = options['verbosity']
+        self.batch_size = options['batch_size']
+        self.default_author = options['author']
+        self.authors = {}
+        self.imported = self.rejected = 0
+        self.rejects = open(options['rejects'], 'w', encoding='utf-8') if options['rejects'] else None
+        started = time.monotonic()
+
+        try:
+            with open(path, encoding='utf-8', newline='') as file:
+                batch = []
+                # line numbers count the CSV header as line 1
+                first_line = 2 if fmt == 'csv' else 1
+                for line, row in enumerate(READERS[fmt](file), start=first_line):
+                    if row is None:
+                        continue
+                    batch.append((line, row))
+                    if len(batch) >= self.batch_size:
+                        self.import_batch(batch)
+                        batch = []
+                if batch:
+                    self.import_batch(batch)
+        finally:
+            if self.rejects:
+                self.rejects.close()
+
+        elapsed = time.monotonic() - started
+        rate = self.imported / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {self.imported} recipes, rejected {self.rejected} rows in {elapsed:.1f}s ({rate:.0f} rows/s).'
+        ))
+        if self.imported:
+            self.stdout.write('Run ingest_recipe_images to copy their pictures.')
+
+    def resolve_authors(self, usernames):
+        """Look up the authors of a batch that are not known yet, in one query."""
+        missing = {name for name in usernames if name and name not in self.authors}
+        if missing:
+            found = User.objects.in_bulk(missing, field_name='username')
+            for name in missing:
+                self.authors[name] = found.get(name)
+
+    def reject(self, line, row, errors):
+        self.rejected += 1
+        if self.rejects:
+            self.rejects.write(json.dumps({'line': line, 'row': row, 'errors': errors}, ensure_ascii=False) + '\n')
+        elif self.verbosity >= 2:
+            self.stderr.write(f'Line {line}: {errors}')
+
+    def import_batch(self, batch):
+        self.resolve_authors(row.get('author') or self.default_author for _, row in batch)
+        items = []
+        for line, row in batch:
+            if '__error__' in row:
+                self.reject(line, row, {'__all__': [row['__error__']]})
+                continue
+            author = self.authors.get(row.get('author') or self.default_author)
+            if author is None:
+                self.reject(line, row, {'author': ['Unknown author.']})
+                continue
+            form = ImportForm(data=row)
+            if not form.is_valid():
+                self.reject(line, row, form.errors.get_json_data())
+                continue
+            item = form.save(commit=False)
+            item.user_name = author
+            item.sanitize_desc()
+            items.append(item)
+
+        # bulk_create skips save() and the signals - sync_items() does their work for the batch
+        with transaction.atomic():
+            items = Item.objects.bulk_create(items)
+            sync_items(items)
+        self.imported += len(items)
+        if self.verbosity >= 2:
+            self.stdout.write(f'{self.imported} recipes imported')
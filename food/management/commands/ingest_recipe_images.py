@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+
+from food.images import ingest
+from food.models import Item
+
+
+class Command(BaseCommand):
+    help = 'Copy recipe images that are still served from their source URL into local storage.'
+
+    def handle(self, *args, **options):
+        items = Item.objects.filter(
+            Q(image_asset__isnull=True) | ~Q(image_asset__source_url=F('item_image'))
+        ).values_list('pk', 'item_image')
+        stored = failed = 0
+        for pk, url in items.iterator():
+            if ingest(pk, url) is None:
+                failed += 1
+            else:
+                stored += 1
+        self.stdout.write(self.style.SUCCESS(f'Stored {stored} images, {failed} failed.'))
@@ -0,0 +1,189 @@
+import itertools
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from star_ratings.models import Rating, UserRating
+
+from food.models import Comment, Item
+from food.signals import sync_comments, sync_items
+from users.signals import build_profiles
+
+USERNAME_PREFIX = 'bench_'
+WORDS = (
+    'tomato basil garlic onion pepper lemon butter cream cheese flour sugar honey ginger chili rice pasta '
+    'chicken beef pork salmon tuna potato carrot spinach mushroom olive thyme rosemary parsley cumin paprika '
+    'roast bake simmer fry grill whisk chop slice stir season crispy tender golden fresh smoky sweet spicy '
+    'soup salad stew curry pie tart bread cake pancake risotto casserole sauce dumpling noodle'
+).split()
+
+
+def zipf_weights(count, exponent):
+    """Cumulative weights where the n-th choice is picked about 1/n^exponent as often as the first."""
+    return list(itertools.accumulate(1 / (rank + 1) ** exponent for rank in range(count)))
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with a reproducible synthetic dataset for benchmarks: users with profiles, '
+        'recipes with rich-text descriptions, and skewed comments and ratings.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--items', type=int, default=2000)
+        parser.add_argument('--comments', type=int, default=10000)
+        parser.add_argument('--ratings', type=int, default=20000, help='User ratings, at most one per user and recipe.')
+        parser.add_argument('--seed', type=int, default=42, help='Seed of the generator, same seed same data.')
+        parser.add_argument('--password', default='benchmark', help='Password of every generated user.')
+        parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of comments and ratings per recipe.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--clear', action='store_true', help='Delete the data of a previous run first.')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        if options['users'] < 1 and (options['items'] or options['comments']):
+            raise CommandError('Recipes and comments need at least one user.')
+        if options['items'] < 1 and options['comments']:
+            raise CommandError('Comments need at least one recipe.')
+        if options['clear']:
+            self.clear()
+
+        users = self.create_users(options['users'], options['password'])
+        items = self.create_items(users, options['items'], options['ratings'], options['skew'])
+        comments = self.create_comments(users, items, options['comments'], options['skew'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(users)} users, {len(items)} recipes, {comments} comments '
+            f'and {self.rating_count} ratings.'
+        ))
+
+    def clear(self):
+        users = User.objects.filter(username__startswith=USERNAME_PREFIX)
+        item_ids = Item.objects.filter(user_name__in=users).values_list('pk', flat=True)
+        Rating.objects.filter(content_type=ContentType.objects.get_for_model(Item), object_id__in=item_ids).delete()
+        # items, comments and profiles go with their users
+        deleted, _ = users.delete()
+        self.stdout.write(f'Deleted {deleted} objects of a previous run.')
+
+    def sentence(self, low, high):
+        words = self.rng.choices(WORDS, k=self.rng.randint(low, high))
+        return ' '.join(words).capitalize()
+
+    def description(self):
+        """CKEditor-like HTML: a few paragraphs, an ingredient list and some emphasis."""
+        paragraphs = [f'<p>{self.sentence(12, 40)}.</p>' for _ in range(self.rng.randint(1, 4))]
+        ingredients = ''.join(f'<li>{self.sentence(1, 4)}</li>' for _ in range(self.rng.randint(3, 10)))
+        tip = f'<p><strong>Tip:</strong> <em>{self.sentence(5, 12)}.</em></p>'
+        return ''.join(paragraphs[:1] + [f'<ul>{ingredients}</ul>'] + paragraphs[1:] + [tip])
+
+    def create_users(self, count, password):
+        start = User.objects.filter(username__startswith=USERNAME_PREFIX).count()
+        # hashing is slow on purpose - do it once for everyone
+        password = make_password(password)
+        users = []
+        for batch_start in range(start, start + count, self.batch_size):
+            batch = [
+                User(username=f'{USERNAME_PREFIX}{i}', email=f'{USERNAME_PREFIX}{i}@example.com', password=password)
+                for i in range(batch_start, min(batch_start + self.batch_size, start + count))
+            ]
+            with transaction.atomic():
+                batch = User.objects.bulk_create(batch)
+                build_profiles(batch)
+            users.extend(batch)
+        return users
+
+    def plan_ratings(self, users, item_count, rating_count, skew):
+        """Return the scores of each recipe, by recipe index."""
+        weights = zipf_weights(item_count, skew)
+        order = list(range(item_count))
+        self.rng.shuffle(order)
+        scores = [dict() for _ in range(item_count)]
+        for _ in range(rating_count):
+            index = order[self.rng.choices(range(item_count), cum_weights=weights)[0]]
+            if len(scores[index]) >= len(users):
+                continue
+            user = self.rng.choice(users)
+            # mostly good marks, like real recipe sites
+            scores[index][user.pk] = self.rng.choices([1, 2, 3, 4, 5], weights=[1, 2, 6, 14, 12])[0]
+        return scores
+
+    def create_items(self, users, count, rating_count, skew):
+        scores = self.plan_ratings(users, count, rating_count, skew)
+        now = timezone.now()
+        item_type = ContentType.objects.get_for_model(Item)
+        items = []
+        self.rating_count = 0
+        for batch_start in range(0, count, self.batch_size):
+            batch = []
+            for index in range(batch_start, min(batch_start + self.batch_size, count)):
+                item_scores = scores[index]
+                item = Item(
+                    user_name=self.rng.choice(users),
+                    item_name=self.sentence(2, 5),
+                    item_desc=self.description(),
+                    item_image=f'https://example.com/recipes/{index}.jpg',
+                    publish_date=now - timedelta(minutes=self.rng.randint(0, 2 * 365 * 24 * 60)),
+                    cooking_time=timedelta(minutes=self.rng.choice([5, 10, 15, 20, 30, 45, 60, 90, 120])),
+                    views=self.rng.randint(0, 10000),
+                    rating_count=len(item_scores),
+                    rating_average=self.average(item_scores),
+                )
+                item.sanitize_desc()
+                batch.append(item)
+
+            with transaction.atomic():
+                batch = Item.objects.bulk_create(batch)
+                sync_items(batch)
+                self.create_ratings(batch, scores[batch_start:batch_start + len(batch)], item_type)
+            items.extend(batch)
+        return items
+
+    @staticmethod
+    def average(scores):
+        if not scores:
+            return Decimal(0)
+        return round(Decimal(sum(scores.values())) / len(scores), 3)
+
+    def create_ratings(self, items, scores, item_type):
+        ratings = Rating.objects.bulk_create([
+            Rating(
+                content_type=item_type,
+                object_id=item.pk,
+                count=len(item_scores),
+                total=sum(item_scores.values()),
+                average=self.average(item_scores),
+            )
+            for item, item_scores in zip(items, scores)
+            if item_scores
+        ])
+        by_item = {rating.object_id: rating for rating in ratings}
+        user_ratings = [
+            UserRating(user_id=user_id, rating=by_item[item.pk], score=score)
+            for item, item_scores in zip(items, scores)
+            for user_id, score in item_scores.items()
+        ]
+        # the manager's bulk_create() recalculates and saves every rating again - the totals are already right
+        UserRating.objects.get_queryset().bulk_create(user_ratings, batch_size=self.batch_size)
+        self.rating_count += len(user_ratings)
+
+    def create_comments(self, users, items, count, skew):
+        weights = zipf_weights(len(items), skew)
+        order = list(items)
+        self.rng.shuffle(order)
+        created = 0
+        for batch_start in range(0, count, self.batch_size):
+            size = min(self.batch_size, count - batch_start)
+            batch = [
+                Comment(item=item, user=self.rng.choice(users), text=self.sentence(3, 30) + '.')
+                for item in self.rng.choices(order, cum_weights=weights, k=size)
+            ]
+            sync_comments(Comment.objects.bulk_create(batch))
+            created += len(batch)
+        return created
@@ -0,0 +1,46 @@
+from django.db import OperationalError, migrations
+from django.utils.html import strip_tags
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE food_item_fts USING fts5("
+                "item_name, item_desc, username, tokenize='unicode61 remove_diacritics 2')"
+            )
+        except OperationalError:
+            # SQLite built without FTS5 - search falls back to icontains.
+            return
+        Item = apps.get_model('food', 'Item')
+        rows = Item.objects.values_list('id', 'item_name', 'item_desc', 'user_name__username')
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO food_item_fts (rowid, item_name, item_desc, username) VALUES (%s, %s, %s, %s)',
+                [(pk, name, strip_tags(desc), username) for pk, name, desc, username in rows.iterator()],
+            )
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE INDEX food_item_search_idx ON food_item USING GIN "
+            "(to_tsvector('simple', item_name || ' ' || item_desc))"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS food_item_fts')
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS food_item_search_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0005_alter_item_item_desc'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
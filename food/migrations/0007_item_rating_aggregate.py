@@ -0,0 +1,42 @@
+# Generated by Django 4.2 on 2026-10-18 14:13
+
+from django.db import migrations, models
+
+
+def copy_ratings(apps, schema_editor):
+    Item = apps.get_model('food', 'Item')
+    Rating = apps.get_model('star_ratings', 'Rating')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    content_type = ContentType.objects.filter(app_label='food', model='item').first()
+    if content_type is None:
+        return
+    ratings = Rating.objects.filter(content_type=content_type)
+    for object_id, average, count in ratings.values_list('object_id', 'average', 'count').iterator():
+        Item.objects.filter(pk=object_id).update(rating_average=average, rating_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0006_item_search'),
+        ('star_ratings', '0003_auto_20160721_1127'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='rating_average',
+            field=models.DecimalField(decimal_places=3, default=0, max_digits=6),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['-rating_average', 'id'], name='food_item_rating_idx'),
+        ),
+        migrations.RunPython(copy_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.2 on 2026-10-18 14:24
+
+from django.db import migrations, models
+
+from food.sanitize import sanitize
+
+
+def sanitize_descriptions(apps, schema_editor):
+    Item = apps.get_model('food', 'Item')
+    items = []
+    for item in Item.objects.only('id', 'item_desc').iterator(chunk_size=500):
+        item.item_desc_html, item.item_desc_text, item.item_excerpt = sanitize(item.item_desc)
+        items.append(item)
+        if len(items) >= 500:
+            Item.objects.bulk_update(items, ['item_desc_html', 'item_desc_text', 'item_excerpt'])
+            items = []
+    Item.objects.bulk_update(items, ['item_desc_html', 'item_desc_text', 'item_excerpt'])
+
+
+def search_plain_text(apps, schema_editor):
+    # The PostgreSQL search index moves from the HTML to the plain text
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS food_item_search_idx')
+        schema_editor.execute(
+            "CREATE INDEX food_item_search_idx ON food_item USING GIN "
+            "(to_tsvector('simple', item_name || ' ' || item_desc_text))"
+        )
+
+
+def search_html(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS food_item_search_idx')
+        schema_editor.execute(
+            "CREATE INDEX food_item_search_idx ON food_item USING GIN "
+            "(to_tsvector('simple', item_name || ' ' || item_desc))"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0009_imageasset'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='item_desc_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='item_desc_text',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='item_excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=300),
+        ),
+        migrations.RunPython(sanitize_descriptions, migrations.RunPython.noop),
+        migrations.RunPython(search_plain_text, search_html),
+    ]
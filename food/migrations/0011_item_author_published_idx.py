@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 14:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0010_item_desc_sanitized'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['user_name', '-publish_date', '-id'], name='food_item_author_published_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-18 15:29
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0011_item_author_published_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='change_date',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2 on 2026-10-18 15:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0012_item_change_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField(unique=True)),
+                ('deleted_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['user_name', 'change_date'], name='food_item_author_changed_idx'),
+        ),
+    ]
@@ -4,31 +4,136 @@ from django.urls import reverse
 from django.contrib.contenttypes.fields import GenericRelation
 from star_ratings.models import Rating
 from django.utils import timezone
+from datetime import datetime, timedelta, timezone as dt_timezone
 from ckeditor.fields import RichTextField
+from django.conf import settings
+from django.core.files.storage import default_storage
+from users.images import FORMATS as IMAGE_FORMATS
+from .sanitize import sanitize
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
 # Create your models here.
 
+class ImageAsset(models.Model):
+    """A recipe image fetched from its source URL and stored locally under the hash of its content."""
+    source_url = models.CharField(max_length=550, unique=True)
+    digest = models.CharField(max_length=64, db_index=True)
+    extension = models.CharField(max_length=10)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.source_url
+
+    @property
+    def file_name(self):
+        return f'recipe_images/{self.digest[:2]}/{self.digest}.{self.extension}'
+
+    def variant_name(self, size, fmt):
+        extension, _ = IMAGE_FORMATS[fmt]
+        return f'recipe_images/{self.digest[:2]}/{self.digest}_{size}.{extension}'
+
+    def variant_url(self, fmt):
+        """URL of the card sized variant, the first of RECIPE_IMAGE_SIZES."""
+        size = settings.RECIPE_IMAGE_SIZES[0]
+        return default_storage.url(self.variant_name(size, fmt))
+
+
 class Item(models.Model):
     user_name = models.ForeignKey(User, on_delete=models.CASCADE, default=1)
     item_name = models.CharField(max_length=200)
     item_desc = RichTextField(max_length=2000)
+    # Filled in from item_desc on save - sanitized HTML to render, plain text to search and list
+    item_desc_html = models.TextField(blank=True, editable=False)
+    item_desc_text = models.TextField(blank=True, editable=False)
+    item_excerpt = models.CharField(max_length=300, blank=True, editable=False)
     item_image = models.CharField(max_length=550, default='https://cdn-icons-png.flaticon.com/512/1147/1147805.png')
+    # Local copy of item_image, filled in after the item is saved
+    image_asset = models.ForeignKey(ImageAsset, on_delete=models.SET_NULL, null=True, blank=True, editable=False)
     ratings = GenericRelation(Rating, related_query_name='items')
     publish_date = models.DateTimeField(default=timezone.now)
     update_date = models.DateTimeField(auto_now=True)
     cooking_time = models.DurationField()
     views = models.PositiveIntegerField(default=0)
+    # Copied from the star_ratings Rating of the item, so ordering needs no generic join
+    rating_average = models.DecimalField(max_digits=6, decimal_places=3, default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    # Last change to the item, its comments or its rating - the version of its cached fragments, see fragments.py
+    change_date = models.DateTimeField(default=timezone.now, db_index=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-rating_average', 'id'], name='food_item_rating_idx'),
+            models.Index(fields=['user_name', '-publish_date', '-id'], name='food_item_author_published_idx'),
+            models.Index(fields=['user_name', 'change_date'], name='food_item_author_changed_idx'),
+        ]
+
+    # Derived from item_desc by sanitize_desc()
+    SANITIZED_FIELDS = ('item_desc_html', 'item_desc_text', 'item_excerpt')
+
+    def sanitize_desc(self):
+        """Fill the sanitized copies of item_desc - bulk_create() and bulk_update() do not call save()."""
+        self.item_desc_html, self.item_desc_text, self.item_excerpt = sanitize(self.item_desc)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'item_desc' in update_fields:
+            self.sanitize_desc()
+            if update_fields is not None:
+                update_fields = kwargs['update_fields'] = {*update_fields, *self.SANITIZED_FIELDS}
+        self.change_date = timezone.now()
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'change_date'}
+        super().save(*args, **kwargs)
+
+    @property
+    def cache_version(self):
+        """The time of the last change in microseconds, for cache keys and validators."""
+        return (self.change_date - EPOCH) // timedelta(microseconds=1)
+
     def get_absolute_url(self):
         return reverse('food:detail', kwargs={'pk': self.pk})
 
+    def _local_image(self, fmt):
+        asset = self.image_asset
+        if asset is None or asset.source_url != self.item_image:
+            return self.item_image
+        return asset.variant_url(fmt)
+
+    @property
+    def image_url(self):
+        """URL of the local copy of the image, or of item_image until it is stored."""
+        return self._local_image('jpeg')
+
+    @property
+    def image_webp_url(self):
+        return self._local_image('webp')
+
     def __str__(self):
         return self.item_name
 
 
+class ItemDeletion(models.Model):
+    """Time an author last deleted one of their items, which leaves no change_date behind - see fragments.py."""
+    # not a foreign key, the row outlives its user so the versions never go back
+    user_id = models.BigIntegerField(unique=True)
+    deleted_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f'Item of user {self.user_id} deleted at {self.deleted_at}'
+
+
 class Comment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='comments')
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='food_comment_created_idx'),
+            models.Index(fields=['item', '-created_at', '-id'], name='food_comment_item_created_idx'),
+        ]
+
     def __str__(self):
         return f'Comment by {self.user.username} on {self.item.item_name}'
@@ -0,0 +1,137 @@
+"""
+Keyset pagination helpers.
+
+Instead of counting rows and skipping them with OFFSET, a page starts right
+after the ordering values of the last row of the previous page. With an
+index on the ordering columns every page costs the same, however deep it is.
+The last ordering field must be unique (usually ``id``) to keep the order
+stable.
+"""
+import base64
+import binascii
+import datetime
+import json
+from decimal import Decimal
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    """A page of rows with the cursors of its neighbours, like Django's Page without a count."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def _field_name(order):
+    return order.lstrip('-')
+
+
+def _to_json(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(values, reverse=False):
+    """Encode the ordering values of a row into an opaque cursor string."""
+    data = {'v': [_to_json(value) for value in values]}
+    if reverse:
+        data['r'] = 1
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor, ordering):
+    """Return ``(values, reverse)`` from a cursor made by encode_cursor()."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        values = data['v']
+        reverse = bool(data.get('r'))
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise InvalidCursor('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise InvalidCursor('Invalid cursor')
+    return values, reverse
+
+
+def row_values(obj, ordering):
+    return [getattr(obj, _field_name(order)) for order in ordering]
+
+
+def keyset_filter(ordering, values, reverse=False):
+    """
+    Return a Q matching the rows after ``values`` in ``ordering``.
+
+    With ``reverse`` it matches the rows before them instead. For an ordering
+    ``(a, b)`` this is ``a > x OR (a = x AND b > y)``.
+    """
+    condition = Q()
+    for i, order in enumerate(ordering):
+        descending = order.startswith('-') != reverse
+        lookup = f'{_field_name(order)}__{"lt" if descending else "gt"}'
+        term = Q(**{lookup: values[i]})
+        for previous, value in zip(ordering[:i], values):
+            term &= Q(**{_field_name(previous): value})
+        condition |= term
+    return condition
+
+
+def reverse_ordering(ordering):
+    return [order[1:] if order.startswith('-') else f'-{order}' for order in ordering]
+
+
+def paginate(queryset, ordering, page_size, cursor=None):
+    """
+    Return one page of ``queryset`` without counting or offsetting.
+
+    Returns ``(rows, next_cursor, previous_cursor)``; a cursor is None when
+    there is no page in that direction.
+    """
+    ordering = list(ordering)
+    reverse = False
+    if cursor:
+        values, reverse = decode_cursor(cursor, ordering)
+        queryset = queryset.filter(keyset_filter(ordering, values, reverse))
+
+    queryset = queryset.order_by(*(reverse_ordering(ordering) if reverse else ordering))
+    rows = list(queryset[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+
+    # Coming from a cursor means there is a page on the side we came from.
+    if reverse:
+        has_next, has_previous = bool(cursor), has_more
+    else:
+        has_next, has_previous = has_more, bool(cursor)
+
+    next_cursor = previous_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor(row_values(rows[-1], ordering))
+    if rows and has_previous:
+        previous_cursor = encode_cursor(row_values(rows[0], ordering), reverse=True)
+    return rows, next_cursor, previous_cursor
@@ -0,0 +1,40 @@
+"""
+Star ratings for whole pages of recipes.
+
+The ``ratings`` tag of django-star-ratings loads - creating it when missing -
+the Rating row of every recipe it renders, plus the user's own vote: two
+queries per card. Recipes keep a copy of their average and count, so the
+``item_ratings`` tag renders the same widget from those, and takes the
+user's votes from ``attach_user_ratings()``, one query for a whole page.
+"""
+from django.contrib.contenttypes.models import ContentType
+from star_ratings import get_star_ratings_rating_model
+from star_ratings.models import UserRating
+
+from .models import Item
+
+
+def item_rating(item):
+    """An unsaved Rating with the recipe's average and count - all the widget reads."""
+    return get_star_ratings_rating_model()(
+        content_type=ContentType.objects.get_for_model(Item),
+        object_id=item.pk,
+        average=item.rating_average,
+        count=item.rating_count,
+    )
+
+
+def attach_user_ratings(items, user):
+    """Set ``user_rating`` on the items to the user's vote, None where there is none."""
+    votes = {}
+    if user.is_authenticated and items:
+        votes = {
+            vote.rating.object_id: vote
+            for vote in UserRating.objects.filter(
+                user=user,
+                rating__content_type=ContentType.objects.get_for_model(Item),
+                rating__object_id__in=[item.pk for item in items],
+            ).select_related('rating')
+        }
+    for item in items:
+        item.user_rating = votes.get(item.pk)
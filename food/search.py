@@ -0,0 +1,130 @@
+"""
+Full-text search over recipes.
+
+On SQLite the recipes are mirrored into the ``food_item_fts`` FTS5 table,
+kept in sync from the Item signals. On PostgreSQL the search runs against a
+GIN-indexed ``to_tsvector`` expression, so no mirror table is needed. Other
+backends fall back to the original ``icontains`` filters.
+"""
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'food_item_fts'
+
+# Keyed by database name, so the test database is checked on its own.
+_fts_available = {}
+
+
+def fts_available():
+    """Return True when the SQLite FTS5 table exists in the database."""
+    if connection.vendor != 'sqlite':
+        return False
+    name = connection.settings_dict['NAME']
+    if name not in _fts_available:
+        _fts_available[name] = FTS_TABLE in connection.introspection.table_names()
+    return _fts_available[name]
+
+
+def _fts_query(query):
+    """Turn user input into an FTS5 expression of quoted prefix terms."""
+    terms = []
+    for term in query.split():
+        term = term.replace('"', '""')
+        terms.append(f'"{term}"*')
+    return ' '.join(terms)
+
+
+def index_item(item):
+    """Add or refresh the search row of an item."""
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [item.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, item_name, item_desc, username) VALUES (%s, %s, %s, %s)',
+            [item.pk, item.item_name, item.item_desc_text, item.user_name.username],
+        )
+
+
+def index_items(items):
+    """Add or refresh the search rows of several items, with their authors loaded."""
+    if not fts_available() or not items:
+        return
+    with connection.cursor() as cursor:
+        placeholders = ', '.join(['%s'] * len(items))
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', [item.pk for item in items])
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, item_name, item_desc, username) VALUES (%s, %s, %s, %s)',
+            [(item.pk, item.item_name, item.item_desc_text, item.user_name.username) for item in items],
+        )
+
+
+def unindex_item(pk):
+    """Remove the search row of a deleted item."""
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [pk])
+
+
+def reindex_author(user):
+    """Refresh the author name stored with the search rows of a user's items."""
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {FTS_TABLE} SET username = %s '
+            f'WHERE rowid IN (SELECT id FROM food_item WHERE user_name_id = %s)',
+            [user.username, user.pk],
+        )
+
+
+def _rank_and_matches(queryset, query):
+    """
+    Return the rank expression and the filter of the items matching ``query``.
+
+    Both are evaluated by the database against the search index, for every
+    match - there is no cap on the number of results.
+    """
+    table = connection.ops.quote_name(queryset.model._meta.db_table)
+    if fts_available():
+        expression = _fts_query(query)
+        # bm25() is negative, the best match has the lowest rank
+        rank = RawSQL(
+            f'SELECT bm25({FTS_TABLE}) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rowid = {table}.id',
+            [expression],
+            output_field=FloatField(),
+        )
+        matches = Q(pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [expression]))
+        return rank, matches
+
+    vector = f"to_tsvector('simple', {table}.item_name || ' ' || {table}.item_desc_text)"
+    # negated, so that the best match has the lowest rank here too - author matches rank 0
+    rank = RawSQL(f"-ts_rank({vector}, websearch_to_tsquery('simple', %s))", [query], output_field=FloatField())
+    matches = Q(pk__in=RawSQL(
+        "SELECT id FROM food_item"
+        " WHERE to_tsvector('simple', item_name || ' ' || item_desc_text) @@ websearch_to_tsquery('simple', %s)",
+        [query],
+    )) | Q(user_name__username__icontains=query)  # as on SQLite and without a search index
+    return rank, matches
+
+
+def search_items(queryset, query):
+    """
+    Filter ``queryset`` to the items matching ``query``, best match first.
+
+    Ranked results are annotated with ``search_rank``, lower being the better match.
+    """
+    if not (fts_available() or connection.vendor == 'postgresql'):
+        return queryset.filter(
+            Q(item_name__icontains=query) |
+            Q(item_desc_text__icontains=query) |
+            Q(user_name__username__icontains=query)
+        )
+
+    if not _fts_query(query):
+        return queryset.none()
+
+    rank, matches = _rank_and_matches(queryset, query)
+    return queryset.filter(matches).annotate(search_rank=rank).order_by('search_rank', 'id')
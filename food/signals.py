@@ -0,0 +1,81 @@
+from django.db.models.signals import post_save, post_delete
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from functools import partial
+from star_ratings.models import Rating
+from .models import Item, Comment
+from . import fragments, images, search
+
+
+@receiver(post_save, sender=Item)
+def index_item(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {'item_name', 'item_desc', 'user_name'} & set(update_fields):
+        search.index_item(instance)
+
+
+@receiver(post_save, sender=Item)
+def copy_image(sender, instance, **kwargs):
+    if instance.image_asset_id and instance.image_asset.source_url == instance.item_image:
+        return
+    # After commit, and in the background - the request never waits for the download
+    transaction.on_commit(partial(images.ingest_queue.put, instance.pk, instance.item_image))
+
+
+@receiver(post_delete, sender=Item)
+def unindex_item(sender, instance, **kwargs):
+    search.unindex_item(instance.pk)
+    fragments.record_deletion(instance.user_name_id)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    fragments.bump_version(instance.item_id)
+
+
+@receiver(post_save, sender=User)
+def reindex_author(sender, instance, created, update_fields=None, **kwargs):
+    # Logins only save last_login - don't touch the search rows for those
+    if created or (update_fields is not None and 'username' not in update_fields):
+        return
+    search.reindex_author(instance)
+    Item.objects.filter(user_name=instance).update(change_date=timezone.now())
+
+
+@receiver(post_save, sender=Rating)
+def copy_rating(sender, instance, created, **kwargs):
+    # The rating widget creates an empty Rating on first render - nothing changed yet
+    if created and not instance.count:
+        return
+    # update() keeps update_date unchanged - a vote is not an edit of the recipe
+    if instance.content_type_id == ContentType.objects.get_for_model(Item).id:
+        Item.objects.filter(pk=instance.object_id).update(
+            rating_average=instance.average,
+            rating_count=instance.count,
+            change_date=timezone.now(),
+        )
+
+
+@receiver(post_delete, sender=Rating)
+def clear_rating(sender, instance, **kwargs):
+    if instance.content_type_id == ContentType.objects.get_for_model(Item).id:
+        Item.objects.filter(pk=instance.object_id).update(rating_average=0, rating_count=0, change_date=timezone.now())
+
+
+def sync_items(items):
+    """
+    Do for items written with bulk_create() or bulk_update() what the post_save receivers do.
+
+    The pictures are left to the ingest_recipe_images command.
+    """
+    items = list(items)
+    search.index_items(items)
+    fragments.bump_versions([item.pk for item in items])
+
+
+def sync_comments(comments):
+    """Do for comments written in bulk what the post_save receivers do."""
+    fragments.bump_versions({comment.item_id for comment in comments})
@@ -0,0 +1,52 @@
+import uuid
+from decimal import Decimal
+
+from django import template
+from django.template import loader
+from django.templatetags.static import static
+from star_ratings import app_settings
+
+from food.ratings import attach_user_ratings, item_rating
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def item_ratings(
+    context, item, icon_height=app_settings.STAR_RATINGS_STAR_HEIGHT, icon_width=app_settings.STAR_RATINGS_STAR_WIDTH,
+    read_only=False, template_name=None,
+):
+    """``{% ratings item %}`` without its queries, see food.ratings."""
+    request = context['request']
+    user = request.user
+    rating = item_rating(item)
+
+    user_rating = None
+    if user.is_authenticated:
+        if not hasattr(item, 'user_rating'):
+            attach_user_ratings([item], user)
+        user_rating = item.user_rating
+    user_rating_percentage = None
+    if user_rating is not None:
+        user_rating_percentage = 100 * (user_rating.score / Decimal(app_settings.STAR_RATINGS_RANGE))
+
+    template_name = template_name or context.get('star_ratings_template_name') or 'star_ratings/widget.html'
+    return loader.get_template(template_name).render({
+        'rating': rating,
+        'request': request,
+        'user': user,
+        'user_rating': user_rating,
+        'user_rating_percentage': user_rating_percentage,
+        'stars': range(1, app_settings.STAR_RATINGS_RANGE + 1),
+        'star_count': app_settings.STAR_RATINGS_RANGE,
+        'percentage': 100 * (Decimal(rating.average) / Decimal(app_settings.STAR_RATINGS_RANGE)),
+        'icon_height': icon_height,
+        'icon_width': icon_width,
+        'sprite_width': icon_width * 3,
+        'sprite_image': static(app_settings.STAR_RATINGS_STAR_SPRITE),
+        'id': f'dsr{uuid.uuid4().hex}',
+        'anonymous_ratings': app_settings.STAR_RATINGS_ANONYMOUS,
+        'read_only': read_only,
+        'editable': not read_only and (user.is_authenticated or app_settings.STAR_RATINGS_ANONYMOUS),
+        'clearable': not read_only and user.is_authenticated and app_settings.STAR_RATINGS_CLEARABLE,
+    }, request=request)
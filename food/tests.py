@@ -1,13 +1,36 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
+from django.conf import settings
+from unittest import skipUnless
 from django.contrib.auth.models import User
 from django.urls import reverse
 from datetime import timedelta
 from .models import Item, Comment
 from .forms import CommentForm, ItemForm
 from .views import UpdateItem
+from .counters import view_counter
+from django.core.management import call_command
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core.cache import cache
+from io import BytesIO, StringIO
+import socket
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from PIL import Image
+from django.core.files.storage import default_storage
+from . import images
+from .images import FetchError, HttpFetcher, ingest_queue, store_image
+from .sanitize import sanitize
+from .search import search_items
+import json
 from star_ratings.models import Rating
 from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
+from unittest import mock
+from mysite.query_budget import QueryBudgetTestMixin
+from .views import IndexClassView
 
 class IndexViewTest(TestCase):
     @classmethod
@@ -59,10 +82,77 @@ class IndexViewTest(TestCase):
         self.assertContains(response, 'Burger')
 
 
+    def test_orders_by_rating_and_keeps_unrated_items(self):
+        unrated = Item.objects.create(
+            item_name='Salad',
+            item_desc='Green salad',
+            cooking_time=timedelta(minutes=5),
+            user_name=self.test_user,
+        )
+        response = self.client.get('/')
+        self.assertEqual(list(response.context['item_list']), [self.item1, self.item2, unrated])
+
+    def test_vote_updates_rating_aggregate(self):
+        voter = User.objects.create_user(username='voter', password='testpass')
+        Rating.objects.rate(self.item2, 1, user=voter)
+        self.item2.refresh_from_db()
+        self.rating2.refresh_from_db()
+        self.assertEqual(self.item2.rating_average, self.rating2.average)
+        self.assertEqual(self.item2.rating_count, self.rating2.count)
+
     def test_pagination_is_three(self):
         response = self.client.get('/')
         self.assertLessEqual(len(response.context['item_list']), 3)
 
+    def test_keyset_pages_without_count(self):
+        for name in ('Soup', 'Salad', 'Stew'):
+            Item.objects.create(
+                item_name=name,
+                item_desc='Starter',
+                cooking_time=timedelta(minutes=10),
+                user_name=self.test_user,
+            )
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/')
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+        first_page = list(response.context['item_list'])
+        self.assertEqual(first_page[:2], [self.item1, self.item2])
+        page_obj = response.context['page_obj']
+        self.assertFalse(page_obj.has_previous())
+        self.assertTrue(page_obj.has_next())
+        self.assertContains(response, f'?cursor={page_obj.next_cursor}')
+
+        response = self.client.get('/', {'cursor': page_obj.next_cursor})
+        second_page = list(response.context['item_list'])
+        self.assertEqual(len(first_page + second_page), 5)
+        self.assertFalse(set(first_page) & set(second_page))
+        self.assertFalse(response.context['page_obj'].has_next())
+
+        response = self.client.get('/', {'cursor': response.context['page_obj'].previous_cursor})
+        self.assertEqual(list(response.context['item_list']), first_page)
+
+    def test_search_results_are_paginated(self):
+        pies = [
+            Item.objects.create(
+                item_name=f'Pie {i}',
+                item_desc='Pie ' * i,
+                cooking_time=timedelta(minutes=10),
+                user_name=self.test_user,
+            )
+            for i in range(1, 5)
+        ]
+        response = self.client.get('/', {'q': 'pie'})
+        first_page = list(response.context['item_list'])
+        next_cursor = response.context['page_obj'].next_cursor
+        response = self.client.get('/', {'q': 'pie', 'cursor': next_cursor})
+        second_page = list(response.context['item_list'])
+        self.assertEqual(len(first_page), 3)
+        self.assertEqual(sorted(first_page + second_page, key=lambda item: item.pk), pies)
+
+    def test_invalid_cursor_is_404(self):
+        response = self.client.get('/', {'cursor': 'bogus'})
+        self.assertEqual(response.status_code, 404)
+
     def test_search_functionality(self):
         response = self.client.get('/?q=Pizza')
         self.assertContains(response, 'Pizza')
@@ -71,8 +161,39 @@ class IndexViewTest(TestCase):
         response = self.client.get('/?q=Sushi')
         self.assertNotContains(response, 'Pizza')
         self.assertNotContains(response, 'Burger')
+        self.assertContains(response, 'No results found.')
+
+    def test_search_matches_description_and_author(self):
+        response = self.client.get('/?q=juicy')
+        self.assertEqual(list(response.context['item_list']), [self.item2])
+        response = self.client.get('/?q=testuser')
+        self.assertEqual(len(response.context['item_list']), 2)
+
+    def test_search_matches_prefix(self):
+        response = self.client.get('/?q=Pizz')
+        self.assertEqual(list(response.context['item_list']), [self.item1])
+
+    def test_search_ranks_best_match_first(self):
+        self.item2.item_desc = '<p>Burger with a pizza topping</p>'
+        self.item2.save()
+        response = self.client.get('/?q=pizza')
+        self.assertEqual(list(response.context['item_list']), [self.item1, self.item2])
+
+    def test_search_index_follows_updates_and_deletes(self):
+        self.item1.item_name = 'Calzone'
+        self.item1.item_desc = 'Folded'
+        self.item1.save()
+        response = self.client.get('/?q=Pizza')
+        self.assertEqual(list(response.context['item_list']), [])
+        response = self.client.get('/?q=Calzone')
+        self.assertEqual(list(response.context['item_list']), [self.item1])
+
+        self.item1.delete()
+        response = self.client.get('/?q=Calzone')
+        self.assertEqual(list(response.context['item_list']), [])
 
 
+@override_settings(VIEW_COUNT_FLUSH_INTERVAL=3600)
 class FoodDetailViewTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -97,6 +218,12 @@ class FoodDetailViewTest(TestCase):
             count=1
         )
 
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        view_counter.flush([self.item1.pk])
+
     def test_view_url_exists_at_proper_location(self):
         response = self.client.get(f'/{self.item1.pk}/')
         self.assertEqual(response.status_code, 200)
@@ -116,9 +243,63 @@ class FoodDetailViewTest(TestCase):
     def test_view_count_increments(self):
         initial_views = self.item1.views
         self.client.get(reverse('food:detail', kwargs={'pk': self.item1.pk}))
+        view_counter.flush()
         self.item1.refresh_from_db()
         self.assertEqual(self.item1.views, initial_views + 1)
 
+    def test_view_count_is_buffered(self):
+        url = reverse('food:detail', kwargs={'pk': self.item1.pk})
+        self.client.get(url)
+        response = self.client.get(url)
+        self.item1.refresh_from_db()
+        self.assertEqual(self.item1.views, 0)
+        self.assertEqual(response.context['object'].views, 2)
+
+    @override_settings(VIEW_COUNT_FLUSH_THRESHOLD=2)
+    def test_view_count_flushes_at_threshold(self):
+        url = reverse('food:detail', kwargs={'pk': self.item1.pk})
+        self.client.get(url)
+        self.client.get(url)
+        self.item1.refresh_from_db()
+        self.assertEqual(self.item1.views, 2)
+        self.assertEqual(view_counter.pending(self.item1.pk), 0)
+
+    def test_flush_view_counts_command(self):
+        self.client.get(reverse('food:detail', kwargs={'pk': self.item1.pk}))
+        out = StringIO()
+        call_command('flush_view_counts', stdout=out, stderr=StringIO())
+        self.item1.refresh_from_db()
+        self.assertEqual(self.item1.views, 1)
+        self.assertIn('Flushed 1 views.', out.getvalue())
+
+    def test_flush_skips_views_claimed_by_another_flush(self):
+        """Test a flush leaves the views of an item locked by another flush buffered, and retries later."""
+        self.client.get(reverse('food:detail', kwargs={'pk': self.item1.pk}))
+        lock = f'food:views:{self.item1.pk}:lock'
+        cache.add(lock, 1)
+        self.assertEqual(view_counter.flush(), 0)
+        self.assertEqual(view_counter.pending(self.item1.pk), 1)
+        cache.delete(lock)
+        self.assertEqual(view_counter.flush(), 1)
+        self.item1.refresh_from_db()
+        self.assertEqual(self.item1.views, 1)
+        self.assertEqual(view_counter.pending(self.item1.pk), 0)
+
+    def test_flush_view_counts_reads_the_log(self):
+        """Test the command writes views buffered by another worker, and only logged ids."""
+        url = reverse('food:detail', kwargs={'pk': self.item1.pk})
+        self.client.get(url)
+        self.client.get(url)
+        view_counter._dirty.clear()  # as if another worker had recorded them
+        with CaptureQueriesContext(connection) as queries:
+            call_command('flush_view_counts', stdout=StringIO(), stderr=StringIO())
+        self.item1.refresh_from_db()
+        self.assertEqual(self.item1.views, 2)
+        self.assertFalse(any('SELECT' in query['sql'] for query in queries.captured_queries))
+        out = StringIO()
+        call_command('flush_view_counts', stdout=out, stderr=StringIO())
+        self.assertIn('Flushed 0 views.', out.getvalue())
+
     def test_post_comment_valid(self):
         self.client.login(username='testuser', password='testpass')
         response = self.client.post(reverse('food:detail', kwargs={'pk': self.item1.pk}), {
@@ -136,6 +317,307 @@ class FoodDetailViewTest(TestCase):
         self.assertFormError(response, 'comment_form', 'text', 'This field is required.')
 
 
+def worker_cache(name):
+    """Give the default cache a location of its own, like the local memory cache of another worker."""
+    return override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': name,
+    }})
+
+
+class FragmentCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create_user(username='testuser', password='testpass')
+        cls.item = Item.objects.create(
+            item_name='Pizza',
+            item_desc='Cheesy pizza',
+            cooking_time=timedelta(minutes=30),
+            user_name=cls.test_user,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_repeated_index_render_hits_cache(self):
+        with CaptureQueriesContext(connection) as first:
+            self.client.get('/')
+        # update() sends no signal - a card rendered again would show the new name
+        Item.objects.filter(pk=self.item.pk).update(item_name='Calzone')
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get('/')
+        self.assertLessEqual(len(second), len(first))
+        self.assertContains(response, 'Pizza')
+
+    def test_item_update_invalidates_card(self):
+        self.client.get('/')
+        self.item.item_name = 'Calzone'
+        self.item.save()
+        response = self.client.get('/')
+        self.assertContains(response, 'Calzone')
+        self.assertNotContains(response, 'Pizza')
+
+    def test_comment_invalidates_detail(self):
+        url = reverse('food:detail', kwargs={'pk': self.item.pk})
+        self.client.get(url)
+        Comment.objects.create(item=self.item, user=self.test_user, text='Fresh comment')
+        self.assertContains(self.client.get(url), 'Fresh comment')
+
+    def test_detail_answers_conditional_get(self):
+        url = reverse('food:detail', kwargs={'pk': self.item.pk})
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        # only the recipe row, for its version
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Comment.objects.create(item=self.item, user=self.test_user, text='Fresh comment')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detail_etag_depends_on_user(self):
+        url = reverse('food:detail', kwargs={'pk': self.item.pk})
+        etag = self.client.get(url)['ETag']
+        self.client.login(username='testuser', password='testpass')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_validators_follow_other_workers(self):
+        """Test a change made by one worker, with a cache of its own, is seen by the validators of another."""
+        url = reverse('food:detail', kwargs={'pk': self.item.pk})
+        with worker_cache('first'):
+            etag = self.client.get(url)['ETag']
+        with worker_cache('second'):
+            Comment.objects.create(item=self.item, user=self.test_user, text='Fresh comment')
+        with worker_cache('first'):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Fresh comment')
+
+    def test_fragments_follow_other_workers(self):
+        """Test the fragments cached by one worker are not served after another worker changed the recipe."""
+        url = reverse('food:detail', kwargs={'pk': self.item.pk})
+        with worker_cache('first'):
+            self.client.get(url)
+            self.client.get('/')
+        with worker_cache('second'):
+            self.item.item_name = 'Calzone'
+            self.item.save()
+            Comment.objects.create(item=self.item, user=self.test_user, text='Fresh comment')
+            Rating.objects.rate(self.item, 4, user=self.test_user)
+        with worker_cache('first'):
+            response = self.client.get(url)
+            self.assertContains(response, 'Calzone')
+            self.assertContains(response, 'Fresh comment')
+            response = self.client.get('/')
+            self.assertContains(response, 'Calzone')
+            self.assertContains(response, 'data-avg-rating="4.000"')
+
+    def test_rating_invalidates_widget(self):
+        self.client.get('/')
+        Rating.objects.rate(self.item, 4, user=self.test_user)
+        response = self.client.get('/')
+        self.assertContains(response, 'data-avg-rating="4.000"')
+
+
+def make_png(color):
+    buffer = BytesIO()
+    Image.new('RGB', (400, 200), color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class FakeFetcher:
+    """Serves images from memory instead of the network."""
+    images = {
+        'https://cdn.example.com/red.png': make_png('red'),
+        'https://mirror.example.com/red.png': make_png('red'),
+        'https://cdn.example.com/blue.png': make_png('blue'),
+    }
+    calls = []
+
+    def __call__(self, url):
+        self.calls.append(url)
+        if url not in self.images:
+            raise FetchError(f'Not found: {url}')
+        return self.images[url]
+
+
+@override_settings(RECIPE_IMAGE_FETCHER='food.tests.FakeFetcher', MEDIA_ROOT=tempfile.mkdtemp())
+class ImageStoreTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create_user(username='testuser', password='testpass')
+
+    def setUp(self):
+        FakeFetcher.calls = []
+
+    def save(self, item):
+        # the request only queues the image, the worker's background thread copies it
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        ingest_queue.drain()
+        item.refresh_from_db()
+        return item
+
+    def create_item(self, url):
+        return self.save(Item(
+            item_name='Tomato',
+            item_desc='Red',
+            item_image=url,
+            cooking_time=timedelta(minutes=5),
+            user_name=self.test_user,
+        ))
+
+    def test_image_is_stored_locally_with_variants(self):
+        item = self.create_item('https://cdn.example.com/red.png')
+        asset = item.image_asset
+        self.assertTrue(default_storage.exists(asset.file_name))
+        self.assertEqual(asset.extension, 'png')
+        with default_storage.open(asset.variant_name(300, 'webp')) as variant, Image.open(variant) as image:
+            self.assertEqual(image.size, (300, 300))
+        self.assertEqual(item.image_url, default_storage.url(asset.variant_name(300, 'jpeg')))
+
+        response = self.client.get(reverse('food:detail', kwargs={'pk': item.pk}))
+        self.assertContains(response, item.image_webp_url)
+        self.assertNotContains(response, 'cdn.example.com')
+
+    def test_same_url_is_fetched_once_and_same_content_stored_once(self):
+        first = self.create_item('https://cdn.example.com/red.png')
+        second = self.create_item('https://cdn.example.com/red.png')
+        mirror = self.create_item('https://mirror.example.com/red.png')
+        self.assertEqual(FakeFetcher.calls, ['https://cdn.example.com/red.png', 'https://mirror.example.com/red.png'])
+        self.assertEqual(first.image_asset, second.image_asset)
+        self.assertEqual(first.image_asset.file_name, mirror.image_asset.file_name)
+
+    def test_changed_url_falls_back_until_stored(self):
+        item = self.create_item('https://cdn.example.com/red.png')
+        item.item_image = 'https://cdn.example.com/missing.png'
+        item = self.save(item)
+        self.assertEqual(item.image_url, 'https://cdn.example.com/missing.png')
+
+        item.item_image = 'https://cdn.example.com/blue.png'
+        item = self.save(item)
+        self.assertEqual(item.image_asset.source_url, 'https://cdn.example.com/blue.png')
+
+
+    def test_saving_only_queues_the_image(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            item = Item.objects.create(
+                item_name='Tomato',
+                item_desc='Red',
+                item_image='https://cdn.example.com/red.png',
+                cooking_time=timedelta(minutes=5),
+                user_name=self.test_user,
+            )
+        self.assertEqual(FakeFetcher.calls, [])
+        self.assertEqual(ingest_queue.drain(), 1)
+        item.refresh_from_db()
+        self.assertIsNotNone(item.image_asset)
+
+    def test_decompression_bomb_is_refused(self):
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 1000):
+            with self.assertRaisesMessage(FetchError, 'Image too large'):
+                store_image('https://cdn.example.com/red.png', make_png('red'))
+
+
+class RedirectHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(302)
+        self.send_header('Location', 'http://169.254.169.254/latest/meta-data/')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpFetcherTest(SimpleTestCase):
+    def test_private_addresses_are_refused(self):
+        for url in (
+            'http://127.0.0.1/image.png',
+            'http://localhost/image.png',
+            'http://169.254.169.254/latest/meta-data/',
+            'http://10.0.0.1/image.png',
+            'http://[::1]/image.png',
+            'http://[::ffff:192.168.0.1]/image.png',
+        ):
+            with self.subTest(url=url), self.assertRaisesMessage(FetchError, 'Not a public address'):
+                HttpFetcher()(url)
+
+    def test_every_resolved_address_is_checked(self):
+        """Test a host resolving to a public and a private address is refused before connecting."""
+        infos = [
+            (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('93.184.216.34', 80)),
+            (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('192.168.1.1', 80)),
+        ]
+        with mock.patch('socket.getaddrinfo', return_value=infos), \
+                mock.patch('socket.create_connection') as connect, \
+                self.assertRaisesMessage(FetchError, 'Not a public address'):
+            HttpFetcher()('http://cdn.example.com/image.png')
+        connect.assert_not_called()
+
+    def test_redirects_are_checked(self):
+        server = HTTPServer(('127.0.0.1', 0), RedirectHandler)
+        threading.Thread(target=server.handle_request, daemon=True).start()
+        checked = []
+        check_address = images._check_address
+
+        def allow_test_server(host, address):
+            checked.append(host)
+            if host != '127.0.0.1':
+                check_address(host, address)
+
+        try:
+            with mock.patch('food.images._check_address', allow_test_server), \
+                    self.assertRaisesMessage(FetchError, 'Not a public address'):
+                HttpFetcher()(f'http://127.0.0.1:{server.server_port}/image.png')
+        finally:
+            server.server_close()
+        self.assertEqual(checked, ['127.0.0.1', '169.254.169.254'])
+
+
+class SanitizeDescriptionTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create_user(username='testuser', password='testpass')
+
+    def test_sanitize_keeps_formatting_and_drops_scripts(self):
+        html, text, excerpt = sanitize(
+            '<p onclick="evil()">Mix <strong>flour</strong> &amp; water</p>'
+            '<script>alert(1)</script><a href="javascript:alert(1)">link</a> '
+            '<a href="https://example.com" target="_blank">ok<ul><li>salt'
+        )
+        self.assertEqual(
+            html,
+            '<p>Mix <strong>flour</strong> &amp; water</p><a>link</a> '
+            '<a href="https://example.com">ok<ul><li>salt</li></ul></a>',
+        )
+        self.assertEqual(text, 'Mix flour & water link ok salt')
+        self.assertEqual(excerpt, text)
+
+    def test_excerpt_is_cut_at_a_word(self):
+        _, text, excerpt = sanitize('<p>' + 'tomato ' * 60 + '</p>')
+        self.assertLessEqual(len(excerpt), 201)
+        self.assertTrue(excerpt.endswith('tomato…'))
+
+    def test_columns_are_filled_on_save(self):
+        item = Item.objects.create(
+            item_name='Soup',
+            item_desc='<p>Hot <img src="x" onerror="evil()"> soup</p>',
+            cooking_time=timedelta(minutes=10),
+            user_name=self.test_user,
+        )
+        item.refresh_from_db()
+        self.assertEqual(item.item_desc_html, '<p>Hot <img src="x"> soup</p>')
+        self.assertEqual(item.item_desc_text, 'Hot soup')
+
+        response = self.client.get(reverse('food:detail', kwargs={'pk': item.pk}))
+        self.assertContains(response, '<p>Hot <img src="x"> soup</p>')
+        self.assertNotContains(response, 'onerror')
+
+
 class CreateItemViewTest(TestCase):
 
     def setUp(self):
@@ -337,4 +819,142 @@ class DeleteCommentViewTest(TestCase):
         self.assertContains(response, self.comment.item.item_name)
 
         # Check if the comment text is displayed in the template
-        self.assertContains(response, self.comment.text)
\ No newline at end of file
+        self.assertContains(response, self.comment.text)
+
+class ImportRecipesTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='chef', password='testpass')
+        self.dir = tempfile.mkdtemp()
+
+    def write(self, name, content):
+        path = f'{self.dir}/{name}'
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def test_import_jsonl(self):
+        """Test valid rows are imported in batches and invalid ones rejected."""
+        rows = [
+            {'author': 'chef', 'item_name': 'Soup', 'item_desc': '<p>Hot soup</p>', 'cooking_time': '00:20:00',
+             'item_image': 'https://example.com/soup.png'},
+            {'author': 'nobody', 'item_name': 'Ghost', 'item_desc': 'Boo', 'cooking_time': '00:01:00',
+             'item_image': 'https://example.com/ghost.png'},
+            {'author': 'chef', 'item_name': 'No time', 'item_desc': 'x', 'item_image': 'https://example.com/x.png'},
+            {'author': 'chef', 'item_name': 'Salad', 'item_desc': 'Green salad', 'cooking_time': '00:05:00',
+             'item_image': 'https://example.com/salad.png', 'publish_date': '2020-01-01T10:00:00'},
+        ]
+        path = self.write('recipes.jsonl', '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n')
+        rejects = f'{self.dir}/rejects.jsonl'
+        out = StringIO()
+        call_command('import_recipes', path, batch_size=2, rejects=rejects, stdout=out)
+
+        self.assertIn('Imported 2 recipes, rejected 3 rows', out.getvalue())
+        soup = Item.objects.get(item_name='Soup')
+        self.assertEqual(soup.user_name, self.user)
+        self.assertEqual(soup.item_desc_text, 'Hot soup')
+        self.assertEqual(Item.objects.get(item_name='Salad').publish_date.year, 2020)
+        with open(rejects, encoding='utf-8') as file:
+            rejected = [json.loads(line) for line in file]
+        self.assertEqual([r['line'] for r in rejected], [2, 3, 5])
+        self.assertIn('cooking_time', rejected[1]['errors'])
+        # searchable right away
+        self.assertEqual(list(search_items(Item.objects.all(), 'soup')), [soup])
+
+    def test_import_csv_with_default_author(self):
+        path = self.write(
+            'recipes.csv',
+            'item_name,item_desc,cooking_time,item_image\nPie,Apple pie,01:00:00,https://example.com/pie.png\n',
+        )
+        call_command('import_recipes', path, author='chef', stdout=StringIO())
+        self.assertEqual(Item.objects.get().user_name, self.user)
+
+
+@skipUnless(
+    'pragmas' in settings.DATABASES['default'].get('OPTIONS', {}), 'Only for the tuned SQLite database profile'
+)
+class DatabaseProfileTest(TestCase):
+
+    def test_pragmas_are_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA temp_store')
+            self.assertEqual(cursor.fetchone()[0], 2)  # MEMORY
+
+
+class SeedBenchmarkTest(TestCase):
+
+    def test_seed_benchmark(self):
+        """Test the dataset is created with consistent rating aggregates."""
+        call_command('seed_benchmark', users=5, items=20, comments=50, ratings=40, batch_size=7, stdout=StringIO())
+        self.assertEqual(User.objects.filter(username__startswith='bench_', profile__isnull=False).count(), 5)
+        self.assertEqual(Item.objects.count(), 20)
+        self.assertEqual(Comment.objects.count(), 50)
+        for item in Item.objects.filter(rating_count__gt=0):
+            rating = Rating.objects.get(content_type=ContentType.objects.get_for_model(Item), object_id=item.pk)
+            self.assertEqual(rating.count, item.rating_count)
+            self.assertEqual(rating.user_ratings.count(), item.rating_count)
+            self.assertEqual(rating.average, item.rating_average)
+
+    def test_seed_is_reproducible(self):
+        call_command('seed_benchmark', users=3, items=5, comments=0, ratings=0, stdout=StringIO())
+        names = list(Item.objects.order_by('id').values_list('item_name', flat=True))
+        call_command('seed_benchmark', users=3, items=5, comments=0, ratings=0, clear=True, stdout=StringIO())
+        self.assertEqual(list(Item.objects.order_by('id').values_list('item_name', flat=True)), names)
+
+
+class QueryBudgetTest(QueryBudgetTestMixin, TestCase):
+
+    def setUp(self):
+        call_command('seed_benchmark', users=3, items=0, comments=0, ratings=0, stdout=StringIO())
+        self.user = User.objects.filter(username__startswith='bench_').first()
+
+    def seed(self, items, comments=0):
+        """Add ``items`` recipes rated by two new users, and ``comments`` comments on them."""
+        call_command(
+            'seed_benchmark', users=2, items=items, comments=comments, ratings=items * 2, seed=Item.objects.count(),
+            stdout=StringIO(),
+        )
+
+    def test_index_budget(self):
+        """Test the index runs the same queries whatever the page size."""
+        self.client.force_login(self.user)
+
+        def request(size):
+            with mock.patch.object(IndexClassView, 'paginate_by', size):
+                return self.client.get(reverse('food:index'))
+
+        self.assertQueryBudget(request, [1, 5, 20], grow=lambda size: self.seed(size - Item.objects.count()))
+
+    def test_index_budget_anonymous(self):
+        def request(size):
+            with mock.patch.object(IndexClassView, 'paginate_by', size):
+                return self.client.get(reverse('food:index'))
+
+        self.assertQueryBudget(request, [1, 5, 20], grow=lambda size: self.seed(size - Item.objects.count()))
+
+    def test_detail_budget(self):
+        """Test the detail page runs the same queries however many comments there are."""
+        self.client.force_login(self.user)
+        items = []
+
+        def grow(size):
+            self.seed(1, comments=size)
+            items.append(Item.objects.latest('id'))
+
+        self.assertQueryBudget(
+            lambda size: self.client.get(reverse('food:detail', args=[items[-1].pk])), [1, 10, 50], grow=grow,
+        )
+
+    def test_rating_widget(self):
+        """Test the cards show the recipe's rating and the user's own vote."""
+        self.seed(1)
+        item = Item.objects.get()
+        rating = Rating.objects.get(object_id=item.pk)
+        vote = rating.user_ratings.first()
+        self.client.force_login(vote.user)
+        response = self.client.get(reverse('food:index'))
+        self.assertContains(response, reverse('ratings:rate', args=[rating.content_type_id, item.pk]))
+        self.assertContains(response, f"Rating Count:  <span class='star-ratings-rating-value'>{item.rating_count}<")
+        self.assertContains(response, f"data-when-null=\"Not rated\">{vote.score}<")
@@ -1,18 +1,23 @@
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, HttpResponseForbidden, HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseForbidden, HttpResponseRedirect
 from .models import Item, Comment
 from .forms import ItemForm, CommentForm
+from .counters import view_counter
+from .search import search_items
+from .pagination import InvalidCursor, KeysetPage, paginate
+from .fragments import conditional_response, set_validators
+from .ratings import attach_user_ratings
 from django.template import loader
 from django.views.generic.list import ListView
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.db.models import Avg
 from django.utils import timezone
-from django.db.models import Q
 from django.contrib import messages
 from django.urls import reverse_lazy
+from django.conf import settings
 # used only for function-based views - manually set the pagination
 # from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 
@@ -22,40 +27,75 @@ class IndexClassView(ListView):
     model = Item
     template_name = 'food/index.html'
     context_object_name = 'item_list'
-    paginate_by = 3
+    paginate_by = settings.PAGINATION_PAGE_SIZE
+    # session, user, the page of recipes and the user's votes on it - whatever the page size
+    query_budget = 4
 
     def get_queryset(self):
         query = self.request.GET.get('q')
         # add - in front of ratings to make descending order - first the highest rating
-        queryset = Item.objects.filter(ratings__isnull=False).order_by('-ratings__average')
+        # the cards don't show the description - leave the big text columns out
+        queryset = (
+            Item.objects.select_related('user_name', 'image_asset')
+            .defer('item_desc', 'item_desc_html', 'item_desc_text')
+            .order_by('-rating_average', 'id')
+        )
 
         if query:
-            queryset = queryset.filter(
-                Q(item_name__icontains=query) |
-                Q(item_desc__icontains=query) |
-                Q(user_name__username__icontains=query)
-            )
+            # ranked full-text search - best matches first
+            queryset = search_items(queryset, query)
 
-        if not queryset.exists():  # If no results found
+        return queryset
+
+    def paginate_queryset(self, queryset, page_size):
+        """Keyset pagination - no COUNT(*) and no OFFSET, pages follow ?cursor= links."""
+        if 'search_rank' in queryset.query.annotations:
+            ordering = ('search_rank', 'id')
+        else:
+            ordering = ('-rating_average', 'id')
+        cursor = self.request.GET.get('cursor')
+        try:
+            rows, next_cursor, previous_cursor = paginate(queryset, ordering, page_size, cursor)
+        except InvalidCursor:
+            raise Http404('Invalid cursor')
+
+        if not rows and not cursor:  # If no results found
             messages.info(self.request, 'No results found.')
 
-        return queryset
+        # the user's votes on the whole page in one query, not one per card
+        attach_user_ratings(rows, self.request.user)
+        page = KeysetPage(rows, next_cursor, previous_cursor)
+        return None, page, rows, page.has_other_pages()
 
 
 # Detail Base View
 class FoodDetail(DetailView):
     model = Item
+    queryset = Item.objects.select_related('user_name', 'image_asset')
     template_name = 'food/detail.html'
+    # session, user, recipe, comments, the user's vote and a view count flush now and then
+    query_budget = 6
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        # The page shows the user's own links, so the validators are per user
+        tag = f'item-{self.object.pk}-user-{request.user.pk}'
+        version = self.object.cache_version
+        not_modified = conditional_response(request, tag, version)
+        if not_modified is not None:
+            view_counter.record(self.object.pk)
+            return not_modified
+        response = self.render_to_response(self.get_context_data(object=self.object))
+        return set_validators(response, tag, version)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        item = self.get_object()
+        item = self.object
 
-#         Increment view count
-        item.views +=1
-        item.save()
+        # Buffer the view instead of saving the whole row; show the buffered views too
+        item.views += view_counter.record(item.pk)
 
-        comments = item.comments.all()
+        comments = item.comments.select_related('user')
         context['comments'] = comments
         context['comment_form'] = CommentForm()
         return context
@@ -0,0 +1,8 @@
+"""Helpers for code that shares state between worker processes through the cache."""
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def is_shared(cache):
+    """Return whether every process sees the same ``cache`` - False for the local memory and dummy backends."""
+    return not isinstance(cache, (LocMemCache, DummyCache))
@@ -0,0 +1,28 @@
+"""
+SQLite backend with per-connection tuning.
+
+Takes two extra OPTIONS on top of Django's SQLite backend:
+
+- ``pragmas``: PRAGMA statements run on every new connection, e.g.
+  ``{'journal_mode': 'WAL', 'synchronous': 'NORMAL'}``.
+- ``transaction_mode``: ``'IMMEDIATE'`` makes transactions take the write
+  lock when they begin, so a transaction that reads before it writes waits
+  for the busy timeout instead of failing with "database is locked".
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_new_connection(self, conn_params):
+        conn_params = dict(conn_params)
+        pragmas = conn_params.pop('pragmas', {})
+        conn_params.pop('transaction_mode', None)
+        conn = super().get_new_connection(conn_params)
+        for name, value in pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        self.cursor().execute(f'BEGIN {mode}' if mode else 'BEGIN')
@@ -0,0 +1,333 @@
+"""
+Request metrics in the Prometheus text format, served at ``/metrics/``.
+
+``MetricsMiddleware`` records for every request, labelled by the resolved
+URL name (``food:index``, ``item-list``, ...): the count by method and
+status, a latency histogram, and histograms of the number and time of its
+database queries. The ``LocMemCache`` backend counts cache hits and misses,
+``rate(cache_requests_total{result="hit"}[5m]) / rate(cache_requests_total[5m])``
+gives the hit ratio.
+
+Each process keeps its metrics in memory. With METRICS_DIR set, processes
+also write them to ``METRICS_DIR/metrics-<pid>.json`` every
+METRICS_FLUSH_INTERVAL seconds and on exit, and ``/metrics/`` adds up the
+files of every process - so any gunicorn worker reports all of them. The
+files of workers that exited are folded into ``metrics-exited.json``, so
+totals do not go backwards and the directory does not grow with every
+worker restart; clear it when the server is restarted. Folding needs file
+locks; where there are none, as on Windows, the files are kept instead.
+
+The metrics name every view and how busy it is, so ``/metrics/`` is only
+served to staff users and, with METRICS_TOKEN set, to
+``Authorization: Bearer <token>`` - the way Prometheus scrapes it.
+"""
+import atexit
+import glob
+import json
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache.backends import locmem
+from django.core.cache.backends.base import BaseCache
+from django.core.exceptions import MiddlewareNotUsed, PermissionDenied
+from django.db import connection
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+
+from .queries import QueryCounter
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# name: (type, help, buckets)
+FAMILIES = {
+    'http_requests_total': ('counter', 'Requests by URL name, method and status.', None),
+    'http_request_duration_seconds': ('histogram', 'Request latency by URL name.', LATENCY_BUCKETS),
+    'http_request_db_queries': ('histogram', 'Database queries per request by URL name.', QUERY_BUCKETS),
+    'http_request_db_seconds': ('histogram', 'Database time per request by URL name.', LATENCY_BUCKETS),
+    'cache_requests_total': ('counter', 'Cache lookups by cache and result, hit or miss.', None),
+}
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Where the metrics of the processes that exited are added up
+EXITED_FILE = 'metrics-exited.json'
+
+
+class Registry:
+    """The metrics of this process. Labels are tuples of (name, value) pairs."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.counters = {}
+        self.histograms = {}
+        self.flushed_at = time.monotonic()
+
+    def _check_fork(self):
+        # a forked worker starts from zero, its parent's metrics stay the parent's
+        if self.pid != os.getpid():
+            self.reset()
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self.lock:
+            self._check_fork()
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = FAMILIES[name][2]
+        key = (name, labels)
+        with self.lock:
+            self._check_fork()
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # a count per bucket and one for +Inf, the sum and the count
+                histogram = self.histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            histogram[0][bisect_left(buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def snapshot(self):
+        """Return the metrics as JSON-able data."""
+        with self.lock:
+            self._check_fork()
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [
+                    [name, labels, list(counts), total, count]
+                    for (name, labels), (counts, total, count) in self.histograms.items()
+                ],
+            }
+
+    def flush(self, directory):
+        """Write the snapshot to ``directory``, replacing the previous one of this process."""
+        snapshot = self.snapshot()
+        self.flushed_at = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        _write(os.path.join(directory, f'metrics-{self.pid}.json'), snapshot)
+
+    def flush_due(self):
+        interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+        return time.monotonic() - self.flushed_at >= interval
+
+
+registry = Registry()
+
+
+def _flush_at_exit():
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if directory and registry.pid == os.getpid():
+        registry.flush(directory)
+
+
+atexit.register(_flush_at_exit)
+
+
+def merge(snapshots):
+    """Add up snapshots of several processes."""
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, counts, total, count in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            if key in histograms:
+                merged = histograms[key]
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+                merged[2] += count
+            else:
+                histograms[key] = [list(counts), total, count]
+    return counters, histograms
+
+
+def as_snapshot(counters, histograms):
+    """Turn merged metrics back into a snapshot."""
+    return {
+        'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+        'histograms': [
+            [name, labels, counts, total, count] for (name, labels), (counts, total, count) in histograms.items()
+        ],
+    }
+
+
+def _load(path):
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None  # the process is gone, or wrote a broken file when it went
+
+
+def _write(path, snapshot):
+    # written aside and moved in place, so readers never see half a file
+    temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        json.dump(snapshot, file)
+    os.replace(temporary, path)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # running, as another user
+    return True
+
+
+def fold_exited(directory):
+    """Add the files of processes that exited to ``metrics-exited.json`` and remove them."""
+    try:
+        import fcntl
+    except ImportError:
+        return  # no file locks, e.g. on Windows - the files are kept
+    exited = os.path.join(directory, EXITED_FILE)
+    # one process folds at a time, or two could fold the same file twice
+    with open(os.path.join(directory, 'metrics.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        paths = []
+        for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            pid = os.path.basename(path)[len('metrics-'):-len('.json')]
+            if pid.isdigit() and not _is_running(int(pid)):
+                paths.append(path)
+        if not paths:
+            return
+        snapshots = [_load(path) for path in [exited] + paths]
+        _write(exited, as_snapshot(*merge(snapshot for snapshot in snapshots if snapshot is not None)))
+        for path in paths:
+            os.remove(path)
+
+
+def collect():
+    """Return the merged counters and histograms of every process."""
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if not directory:
+        return merge([registry.snapshot()])
+    registry.flush(directory)
+    fold_exited(directory)
+    snapshots = (_load(path) for path in glob.glob(os.path.join(directory, 'metrics-*.json')))
+    return merge(snapshot for snapshot in snapshots if snapshot is not None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(counters, histograms):
+    """Return the metrics in the Prometheus text exposition format."""
+    lines = []
+    for family, (kind, help_text, buckets) in FAMILIES.items():
+        lines.append(f'# HELP {family} {help_text}')
+        lines.append(f'# TYPE {family} {kind}')
+        if kind == 'counter':
+            for (name, labels), value in sorted(counters.items()):
+                if name == family:
+                    lines.append(f'{family}{_labels(labels)} {_number(value)}')
+            continue
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            if name != family:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                lines.append(f'{family}_bucket{_labels(labels + (("le", _number(bound)),))} {cumulative}')
+            lines.append(f'{family}_sum{_labels(labels)} {_number(total)}')
+            lines.append(f'{family}_count{_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """Serve the metrics to staff users and, with METRICS_TOKEN set, to ``Authorization: Bearer <token>``."""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    authorized = token and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}')
+    if not authorized and not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(render(*collect()), content_type=CONTENT_TYPE)
+
+
+class MetricsMiddleware:
+    """Record the metrics of every request, see the module docstring. Goes first."""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = (('view', match.view_name if match is not None else 'unmatched'),)
+        method = request.method if request.method in METHODS else 'other'
+        registry.inc('http_requests_total', view + (('method', method), ('status', str(response.status_code))))
+        registry.observe('http_request_duration_seconds', view, elapsed)
+        registry.observe('http_request_db_queries', view, counter.count)
+        registry.observe('http_request_db_seconds', view, counter.seconds)
+
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if directory and registry.flush_due():
+            registry.flush(directory)
+        return response
+
+
+class CacheMetricsMixin:
+    """
+    Cache backend mixin counting the hits and misses of ``get()`` and ``get_many()``.
+
+    The cache is labelled with its METRICS_NAME parameter, 'default' if unset.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(location, params)
+        self.metrics_labels = (('cache', params.get('METRICS_NAME', 'default')),)
+
+    def get(self, key, default=None, version=None):
+        missing = object()
+        value = super().get(key, missing, version)
+        hit = value is not missing
+        registry.inc('cache_requests_total', self.metrics_labels + (('result', 'hit' if hit else 'miss'),))
+        return value if hit else default
+
+    def get_many(self, keys, version=None):
+        if super().get_many.__func__ is BaseCache.get_many:
+            # the generic get_many() calls get() for each key, those are counted already
+            return super().get_many(keys, version)
+        keys = list(keys)
+        values = super().get_many(keys, version)
+        if values:
+            registry.inc('cache_requests_total', self.metrics_labels + (('result', 'hit'),), len(values))
+        if len(keys) > len(values):
+            registry.inc('cache_requests_total', self.metrics_labels + (('result', 'miss'),), len(keys) - len(values))
+        return values
+
+
+class LocMemCache(CacheMetricsMixin, locmem.LocMemCache):
+    pass
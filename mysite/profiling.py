@@ -0,0 +1,157 @@
+"""
+Profiling of single requests, on demand.
+
+A request is profiled with cProfile when it carries ``X-Profile: 1`` (or
+``?_profile=1``) from a staff user, or ``X-Profile: <token>`` with a token
+from ``make_token()``::
+
+    python manage.py shell -c "from mysite.profiling import make_token; print(make_token())"
+
+The response gets a ``Server-Timing`` header with the time spent in SQL,
+template rendering, serialization and authentication, and the total. The
+parts overlap - a query run while rendering counts in sql and template.
+With PROFILING_STORE_DIR set the full profile is kept too, for staff to
+download from the URL in ``X-Profile-Url``. Requests without the header
+or the parameter only pay for two dict lookups.
+"""
+import cProfile
+import os
+import pstats
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import FileResponse, Http404
+from django.urls import reverse
+
+from .queries import QueryCounter
+
+HEADER = 'HTTP_X_PROFILE'
+PARAM = '_profile'
+SALT = 'mysite.profiling'
+
+# Profiled code each part of Server-Timing is made of, by path fragment of the source file
+CATEGORIES = {
+    'template': ('/django/template/', '/templatetags/'),
+    'serialization': (
+        '/rest_framework/serializers.py', '/rest_framework/fields.py', '/rest_framework/relations.py',
+        '/rest_framework/renderers.py',
+    ),
+    'auth': (
+        '/django/contrib/auth/', '/rest_framework/authentication.py', '/rest_framework_simplejwt/',
+        '/api/authentication.py',
+    ),
+}
+
+
+def make_token():
+    """Return a token that has requests profiled for PROFILING_TOKEN_MAX_AGE seconds."""
+    return signing.dumps('profile', salt=SALT)
+
+
+def _valid_token(value):
+    try:
+        max_age = getattr(settings, 'PROFILING_TOKEN_MAX_AGE', 3600)
+        return signing.loads(value, salt=SALT, max_age=max_age) == 'profile'
+    except signing.BadSignature:
+        return False
+
+
+def _category(filename):
+    filename = filename.replace(os.sep, '/')
+    for name, fragments in CATEGORIES.items():
+        if any(fragment in filename for fragment in fragments):
+            return name
+    return None
+
+
+def breakdown(stats):
+    """
+    Return the seconds spent in each of CATEGORIES.
+
+    Only calls coming from outside a category count, so code calling itself
+    within the category - nested templates, nested serializers - is not
+    counted twice.
+    """
+    totals = dict.fromkeys(CATEGORIES, 0.0)
+    for (filename, _, _), (_, _, _, _, callers) in stats.stats.items():
+        name = _category(filename)
+        if name is None:
+            continue
+        for (caller_filename, _, _), caller in callers.items():
+            if _category(caller_filename) != name:
+                totals[name] += caller[3]
+    return totals
+
+
+class ProfilingMiddleware:
+    """
+    Profile the requests that ask for it, see the module docstring.
+
+    Goes after AuthenticationMiddleware, so staff users can be recognised.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if HEADER not in request.META and PARAM not in request.META.get('QUERY_STRING', ''):
+            return self.get_response(request)
+        if not self.authorized(request):
+            return self.get_response(request)
+        return self.profile(request)
+
+    def authorized(self, request):
+        value = request.META.get(HEADER) or request.GET.get(PARAM)
+        if value is None:
+            return False
+        if value == '1':
+            return request.user.is_staff
+        return _valid_token(value)
+
+    def profile(self, request):
+        profiler = cProfile.Profile()
+        timer = QueryCounter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            total = time.perf_counter() - started
+
+        stats = pstats.Stats(profiler)
+        timings = [f'sql;dur={timer.seconds * 1000:.1f};desc="{timer.count} queries"']
+        timings += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in breakdown(stats).items()]
+        timings.append(f'total;dur={total * 1000:.1f}')
+        response['Server-Timing'] = ', '.join(timings)
+
+        directory = getattr(settings, 'PROFILING_STORE_DIR', None)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            profile_id = uuid.uuid4()
+            stats.dump_stats(os.path.join(directory, f'{profile_id.hex}.prof'))
+            response['X-Profile-Url'] = request.build_absolute_uri(reverse('download_profile', args=[profile_id]))
+        return response
+
+
+@staff_member_required
+def download_profile(request, profile_id):
+    """Send a stored profile, to open with pstats or snakeviz."""
+    directory = getattr(settings, 'PROFILING_STORE_DIR', None)
+    if not directory:
+        raise Http404('Profiles are not stored')
+    path = os.path.join(directory, f'{profile_id.hex}.prof')
+    if not os.path.exists(path):
+        raise Http404('No such profile')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{profile_id.hex}.prof')
@@ -0,0 +1,21 @@
+"""
+Counting of the database queries run by a block of code, shared by the
+query budgets, the profiler, the metrics and the benchmark commands.
+"""
+import time
+
+
+class QueryCounter:
+    """Database execute wrapper that counts the queries run through it and adds up their time."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
@@ -0,0 +1,116 @@
+"""
+Query budgets - the most queries a view may run for one request.
+
+Function views declare theirs with ``@query_budget(n)``, class based views
+with a ``query_budget`` attribute and viewsets with ``query_budgets``, a
+dict by action name. A budget is a constant: a view whose query count grows
+with the page size or the amount of data has an N+1 somewhere.
+
+``QueryBudgetTestMixin.assertQueryBudget()`` checks a view against its
+budget at several data sizes, and ``QueryBudgetMiddleware`` reports the
+requests over budget at runtime when QUERY_BUDGET_MODE is set.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .queries import QueryCounter
+
+logger = logging.getLogger(__name__)
+
+MODES = ('log', 'flag')
+
+
+def query_budget(queries):
+    """Decorator setting the query budget of a function view."""
+    def decorator(view):
+        view.query_budget = queries
+        return view
+    return decorator
+
+
+def view_budget(resolver_match, method):
+    """Return the budget of the view ``resolver_match`` points to for ``method``, None if it has none."""
+    view = resolver_match.func
+    # DRF keeps the viewset and the method to action map on the view function
+    actions = getattr(view, 'actions', None)
+    if actions:
+        budgets = getattr(view.cls, 'query_budgets', {})
+        action = actions.get(method.lower())
+        if action in budgets:
+            return budgets[action]
+    view_class = getattr(view, 'view_class', None)
+    if view_class is not None:
+        return getattr(view_class, 'query_budget', None)
+    return getattr(view, 'query_budget', None)
+
+
+class QueryBudgetMiddleware:
+    """
+    Count the queries of every request and report those over their view's budget.
+
+    QUERY_BUDGET_MODE 'log' logs a warning, 'flag' also sets the
+    X-Query-Budget-Exceeded header to "<queries>/<budget>". Without a mode
+    the middleware takes itself out of the chain.
+    """
+
+    def __init__(self, get_response):
+        self.mode = getattr(settings, 'QUERY_BUDGET_MODE', None)
+        if self.mode not in MODES:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        if request.resolver_match is None:
+            return response
+        budget = view_budget(request.resolver_match, request.method)
+        if budget is not None and counter.count > budget:
+            logger.warning(
+                'Query budget exceeded: %s %s (%s) ran %d queries, budget %d',
+                request.method, request.path, request.resolver_match.view_name, counter.count, budget,
+            )
+            if self.mode == 'flag':
+                response['X-Query-Budget-Exceeded'] = f'{counter.count}/{budget}'
+        return response
+
+
+class QueryBudgetTestMixin:
+    """TestCase mixin checking views against their query budgets."""
+
+    def assertQueryBudget(self, request, sizes, grow=None):
+        """
+        Call ``grow(size)`` and then ``request(size)`` for each of ``sizes``.
+
+        ``request`` makes a request with the test client and returns the
+        response. Fails if a request runs more queries than its view's budget,
+        or a different number of queries than at the first size. Caches are
+        cleared before each request, so the counts are the cold ones.
+        """
+        counts = []
+        for size in sizes:
+            if grow is not None:
+                grow(size)
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = request(size)
+            self.assertLess(response.status_code, 400, f'Request at size {size} failed.')
+            budget = view_budget(response.resolver_match, response.request['REQUEST_METHOD'])
+            self.assertIsNotNone(budget, f'{response.resolver_match.view_name} has no query budget.')
+            self.assertLessEqual(
+                len(queries), budget,
+                f'{response.resolver_match.view_name} ran {len(queries)} queries at size {size}, '
+                f'budget {budget}:\n' + '\n'.join(query['sql'] for query in queries.captured_queries),
+            )
+            counts.append(len(queries))
+        self.assertEqual(
+            len(set(counts)), 1,
+            f'Query count changes with the size: {dict(zip(sizes, counts))}',
+        )
+        return counts
@@ -52,12 +52,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'mysite.metrics.MetricsMiddleware',
+    'mysite.query_budget.QueryBudgetMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'mysite.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -86,11 +89,54 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
+# Pick a profile with the DATABASE_PROFILE environment variable:
+# 'sqlite' - SQLite in WAL mode, readers do not block the writer and writers wait for each other
+# 'sqlite-legacy' - SQLite with its default rollback journal, as originally configured
+# 'postgres' - PostgreSQL with persistent, health-checked connections
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite')
+
+DATABASE_PROFILES = {
+    'sqlite': {
+        'ENGINE': 'mysite.db.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            # seconds a writer waits for the lock before "database is locked"
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {
+                'journal_mode': 'WAL',
+                # with WAL only a power loss can lose the last commits, never corrupt the database
+                'synchronous': 'NORMAL',
+                'mmap_size': 256 * 1024 * 1024,
+                'temp_store': 'MEMORY',
+            },
+        },
+    },
+    'sqlite-legacy': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    'postgres': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'foodapp'),
+        'USER': os.environ.get('POSTGRES_USER', 'foodapp'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        # connections are reused across requests and checked before reuse
+        'CONN_MAX_AGE': int(os.environ.get('POSTGRES_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        # set when connecting through PgBouncer in transaction pooling mode
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('POSTGRES_PGBOUNCER') == '1',
+        'OPTIONS': {
+            'connect_timeout': 5,
+        },
+    },
+}
+
+DATABASES = {
+    'default': DATABASE_PROFILES[DATABASE_PROFILE],
 }
 
 
@@ -140,13 +186,51 @@ LOGIN_URL = 'login'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'pictures')
 MEDIA_URL = '/pictures/'
 CKEDITOR_UPLOAD_PATH = "uploads/"
+# Square thumbnails made for every uploaded profile picture (JPEG and WebP)
+PROFILE_IMAGE_SIZES = (150, 300)
+# Recipe images are copied from item_image into MEDIA_ROOT/recipe_images, resized to these sizes
+RECIPE_IMAGE_SIZES = (300,)
+RECIPE_IMAGE_FETCHER = 'food.images.HttpFetcher'
+RECIPE_IMAGE_MAX_BYTES = 10 * 1024 * 1024
+
+# Report requests over their view's query budget: 'log' logs them, 'flag' also sets a response header
+QUERY_BUDGET_MODE = os.environ.get('QUERY_BUDGET_MODE')
+
+# On-demand profiling of single requests, see mysite/profiling.py - signed tokens last this many seconds
+PROFILING_ENABLED = True
+PROFILING_TOKEN_MAX_AGE = 3600
+# Directory to keep the full profiles in for download, None to keep only the Server-Timing header
+PROFILING_STORE_DIR = os.environ.get('PROFILING_STORE_DIR')
+
+# Prometheus metrics at /metrics/, see mysite/metrics.py. With METRICS_DIR set, worker processes share their
+# metrics through files there, written every METRICS_FLUSH_INTERVAL seconds. The endpoint is served to staff users
+# and to requests with the METRICS_TOKEN bearer token.
+METRICS_ENABLED = True
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 5
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+CACHES = {
+    'default': {
+        # LocMemCache counting its hits and misses for the metrics
+        'BACKEND': 'mysite.metrics.LocMemCache',
+        'METRICS_NAME': 'default',
+    },
+}
 
 # Pagination settings
 PAGINATION_PAGE_SIZE = 3
+# Recipes per page on the profile pages
+PROFILE_RECIPES_PAGE_SIZE = 10
+
+# View counter settings - buffered views are written after this many views or seconds
+VIEW_COUNT_CACHE_ALIAS = 'default'
+VIEW_COUNT_FLUSH_THRESHOLD = 50
+VIEW_COUNT_FLUSH_INTERVAL = 30
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
@@ -162,7 +246,11 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.BrowsableAPIRenderer',
         'rest_framework.renderers.TemplateHTMLRenderer',
     ),
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
+    'PAGE_SIZE': 20,
 }
+# Most entries accepted by one request to the /bulk/ endpoints
+API_BULK_MAX_SIZE = 500
 
 # JWT settings
 SIMPLE_JWT = {
@@ -170,7 +258,21 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'AUTH_HEADER_TYPES': ('Bearer',),
     'TOKEN_OBTAIN_SERIALIZER': 'api.serializers.MyTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'api.serializers.FilteredTokenRefreshSerializer',
+    'TOKEN_VERIFY_SERIALIZER': 'api.serializers.FilteredTokenVerifySerializer',
+    'TOKEN_BLACKLIST_SERIALIZER': 'api.serializers.FilteredTokenBlacklistSerializer',
 }
+# Verified access tokens kept in memory per worker, and seconds an authenticated user stays cached
+JWT_TOKEN_CACHE_SIZE = 1024
+JWT_USER_CACHE_TIMEOUT = 300
+# Authenticated users are only cached when this cache is shared by the workers
+JWT_USER_CACHE_ALIAS = 'default'
+# Blacklisted refresh tokens the per-worker filter is sized for, and its false positive rate
+JWT_BLACKLIST_FILTER_CAPACITY = 10000
+JWT_BLACKLIST_FILTER_ERROR_RATE = 0.001
+# The filter is only used when this cache is shared by the workers, and reads new entries at least this often
+JWT_BLACKLIST_CACHE_ALIAS = 'default'
+JWT_BLACKLIST_FILTER_SYNC_INTERVAL = 60
 
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
@@ -0,0 +1,190 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from food.models import Item
+from food.views import IndexClassView
+from .metrics import Registry, collect, registry
+from .profiling import make_token
+from .query_budget import QueryBudgetMiddleware, QueryBudgetTestMixin
+
+
+class QueryBudgetTest(QueryBudgetTestMixin, TestCase):
+
+    def setUp(self):
+        call_command('seed_benchmark', users=3, items=3, comments=0, ratings=0, stdout=StringIO())
+        self.user = User.objects.filter(username__startswith='bench_').first()
+
+    def test_budget_is_required(self):
+        """Test a view without a budget fails the helper."""
+        self.client.force_login(self.user)
+        with self.assertRaises(AssertionError):
+            self.assertQueryBudget(lambda size: self.client.get(reverse('food:create_item')), [1])
+
+    def test_growing_queries_fail(self):
+        """Test a view whose queries grow with the data fails the helper, even within the budget."""
+        self.client.force_login(self.user)
+
+        def request(size):
+            for _ in range(size):
+                Item.objects.count()
+            return self.client.get(reverse('food:index'))
+
+        with mock.patch.object(IndexClassView, 'query_budget', 100):
+            with self.assertRaisesMessage(AssertionError, 'Query count changes with the size'):
+                self.assertQueryBudget(request, [1, 2])
+
+    @override_settings(QUERY_BUDGET_MODE='flag')
+    def test_middleware_flags_requests_over_budget(self):
+        self.client.force_login(self.user)
+        with mock.patch.object(IndexClassView, 'query_budget', 1), self.assertLogs('mysite.query_budget', 'WARNING'):
+            response = self.client.get(reverse('food:index'))
+        self.assertRegex(response['X-Query-Budget-Exceeded'], r'^\d+/1$')
+        response = self.client.get(reverse('food:index'))
+        self.assertNotIn('X-Query-Budget-Exceeded', response)
+
+    def test_middleware_is_off_by_default(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            QueryBudgetMiddleware(lambda request: None)
+
+
+class ProfilingMiddlewareTest(TestCase):
+
+    def setUp(self):
+        self.staff = User.objects.create_user(username='staff', password='testpass', is_staff=True)
+        Item.objects.create(item_name='Pizza', item_desc='Cheesy', cooking_time=timedelta(minutes=30), user_name=self.staff)
+
+    def timings(self, response):
+        return {part.split(';')[0]: part for part in response['Server-Timing'].split(', ')}
+
+    def test_staff_request_is_profiled(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('food:index'), {'_profile': '1'})
+        timings = self.timings(response)
+        self.assertEqual(set(timings), {'sql', 'template', 'serialization', 'auth', 'total'})
+        self.assertIn('queries"', timings['sql'])
+        self.assertNotEqual(timings['template'], 'template;dur=0.0')
+
+    def test_signed_token_profiles_api_request(self):
+        response = self.client.get(reverse('item-list'), HTTP_X_PROFILE=make_token())
+        self.assertNotEqual(self.timings(response)['serialization'], 'serialization;dur=0.0')
+
+    def test_other_requests_are_not_profiled(self):
+        """Test requests without a valid trigger are served without the profiler."""
+        user = User.objects.create_user(username='user', password='testpass')
+        self.client.force_login(user)
+        with mock.patch('mysite.profiling.cProfile.Profile') as profile:
+            for headers in ({}, {'HTTP_X_PROFILE': '1'}, {'HTTP_X_PROFILE': 'forged'}):
+                response = self.client.get(reverse('food:index'), **headers)
+                self.assertNotIn('Server-Timing', response)
+        profile.assert_not_called()
+
+    def test_profile_is_stored(self):
+        self.client.force_login(self.staff)
+        with tempfile.TemporaryDirectory() as directory, override_settings(PROFILING_STORE_DIR=directory):
+            response = self.client.get(reverse('food:index'), HTTP_X_PROFILE='1')
+            download = self.client.get(response['X-Profile-Url'])
+            self.assertEqual(download.status_code, 200)
+            self.assertTrue(b''.join(download.streaming_content))
+            download.close()
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        registry.reset()
+        cache.clear()
+
+    def scrape(self):
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_requests_are_labelled_by_url_name(self):
+        self.client.get(reverse('food:index'))
+        self.client.get(reverse('food:index'))
+        self.client.get(reverse('item-list'))
+        text = self.scrape()
+        self.assertIn('http_requests_total{view="food:index",method="GET",status="200"} 2', text)
+        self.assertIn('http_requests_total{view="item-list",method="GET",status="200"} 1', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="food:index",le="+Inf"} 2', text)
+        self.assertIn('http_request_db_queries_count{view="item-list"} 1', text)
+        self.assertIn('# TYPE http_request_db_seconds histogram', text)
+
+    def test_cache_hits_and_misses(self):
+        cache.set('present', 1)
+        cache.get('present')
+        cache.get('absent')
+        cache.get_many(['present', 'absent', 'other'])
+        counters, _ = collect()
+        self.assertEqual(counters['cache_requests_total', (('cache', 'default'), ('result', 'hit'))], 2)
+        self.assertEqual(counters['cache_requests_total', (('cache', 'default'), ('result', 'miss'))], 3)
+
+    def write_worker_file(self, directory, pid):
+        other = Registry()
+        other.inc('http_requests_total', (('view', 'food:index'), ('method', 'GET'), ('status', '200')), 5)
+        other.observe('http_request_db_queries', (('view', 'food:index'),), 3)
+        with open(f'{directory}/metrics-{pid}.json', 'w') as file:
+            json.dump(other.snapshot(), file)
+
+    def test_worker_files_are_added_up(self):
+        """Test each worker reports the metrics of every worker."""
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            self.write_worker_file(directory, os.getppid())
+            self.client.get(reverse('food:index'))
+            text = self.scrape()
+        self.assertIn('http_requests_total{view="food:index",method="GET",status="200"} 6', text)
+        self.assertIn('http_request_db_queries_bucket{view="food:index",le="3"} 2', text)
+        self.assertIn('http_request_db_queries_count{view="food:index"} 2', text)
+
+    def test_exited_workers_are_folded(self):
+        """Test the files of exited workers are added to one file, and their metrics kept."""
+        pids = []
+        for _ in range(2):
+            process = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True)
+            pids.append(int(process.stdout))
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            self.write_worker_file(directory, pids[0])
+            self.scrape()
+            self.write_worker_file(directory, pids[1])
+            text = self.scrape()
+            files = set(os.listdir(directory))
+        self.assertEqual(files, {'metrics-exited.json', f'metrics-{os.getpid()}.json', 'metrics.lock'})
+        self.assertIn('http_requests_total{view="food:index",method="GET",status="200"} 10', text)
+        self.assertIn('http_request_db_queries_count{view="food:index"} 2', text)
+
+    def test_exited_workers_are_kept_without_file_locks(self):
+        """Test the files are left alone where fcntl is missing, as on Windows."""
+        process = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True)
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            self.write_worker_file(directory, int(process.stdout))
+            with mock.patch.dict(sys.modules, {'fcntl': None}):
+                text = self.scrape()
+            self.assertIn(f'metrics-{int(process.stdout)}.json', os.listdir(directory))
+        self.assertIn('http_requests_total{view="food:index",method="GET",status="200"} 5', text)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_staff_is_required_without_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_login(User.objects.create_user(username='user', password='testpass'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_login(User.objects.create_user(username='staff', password='testpass', is_staff=True))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    def test_token_is_required(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertIn('# TYPE', self.scrape())
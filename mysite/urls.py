@@ -24,6 +24,8 @@ from rest_framework_simplejwt.views import TokenRefreshView, TokenObtainPairView
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
+from mysite.metrics import metrics_view
+from mysite.profiling import download_profile
 
 
 schema_view = get_schema_view(
@@ -57,6 +59,8 @@ urlpatterns = [
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    path('profiling/<uuid:profile_id>/', download_profile, name='download_profile'),
+    path('metrics/', metrics_view, name='metrics'),
 ]
 
 # Copy this code from documentation - how to display images in development serve
@@ -7,6 +7,7 @@ For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/wsgi/
 """
 
+import atexit
 import os
 
 from django.core.wsgi import get_wsgi_application
@@ -14,3 +15,12 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_wsgi_application()
+
+from food.counters import view_counter  # noqa: E402
+from food.images import ingest_queue  # noqa: E402
+
+# Write the views buffered by this worker periodically and when it exits
+view_counter.start()
+atexit.register(view_counter.flush)
+# Copy the images of saved recipes in the background
+ingest_queue.start()
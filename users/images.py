@@ -0,0 +1,91 @@
+"""
+Resized variants of profile pictures.
+
+Every uploaded picture gets square thumbnails in JPEG and WebP, stored next
+to the original as ``<name>_<size>.jpg`` and ``<name>_<size>.webp``, so pages
+never have to serve the full size upload for an avatar.
+"""
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+DEFAULT_IMAGE = 'profilepic.jpg'
+
+FORMATS = {
+    'jpeg': ('jpg', {'format': 'JPEG', 'quality': 85, 'optimize': True}),
+    'webp': ('webp', {'format': 'WEBP', 'quality': 80, 'method': 6}),
+}
+
+
+def variant_sizes():
+    return getattr(settings, 'PROFILE_IMAGE_SIZES', (150, 300))
+
+
+def variant_name(name, size, fmt):
+    base, _ = os.path.splitext(name)
+    extension, _ = FORMATS[fmt]
+    return f'{base}_{size}.{extension}'
+
+
+def has_variants(image):
+    return bool(image) and image.name != DEFAULT_IMAGE
+
+
+def build_variants(image, force=False):
+    """Create the missing thumbnails of an uploaded picture. Returns the names written."""
+    if not has_variants(image):
+        return []
+    storage = image.storage
+    wanted = [
+        (size, fmt, variant_name(image.name, size, fmt))
+        for size in variant_sizes()
+        for fmt in FORMATS
+    ]
+    if not force:
+        wanted = [(size, fmt, name) for size, fmt, name in wanted if not storage.exists(name)]
+    if not wanted:
+        return []
+
+    try:
+        image.open('rb')
+        with Image.open(image) as original:
+            original = ImageOps.exif_transpose(original).convert('RGB')
+    except (OSError, ValueError):
+        # Missing or unreadable file - keep serving the original
+        return []
+    finally:
+        image.close()
+
+    written = []
+    for size, fmt, name in wanted:
+        thumbnail = ImageOps.fit(original, (size, size), Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        _, options = FORMATS[fmt]
+        thumbnail.save(buffer, **options)
+        if storage.exists(name):
+            storage.delete(name)
+        written.append(storage.save(name, ContentFile(buffer.getvalue())))
+    return written
+
+
+def delete_variants(image):
+    if not has_variants(image):
+        return
+    for size in variant_sizes():
+        for fmt in FORMATS:
+            name = variant_name(image.name, size, fmt)
+            if image.storage.exists(name):
+                image.storage.delete(name)
+
+
+def variant_urls(image):
+    """Return ``{size: {'jpeg': url, 'webp': url}}`` for an uploaded picture."""
+    if not has_variants(image):
+        return {}
+    return {
+        size: {fmt: image.storage.url(variant_name(image.name, size, fmt)) for fmt in FORMATS}
+        for size in variant_sizes()
+    }
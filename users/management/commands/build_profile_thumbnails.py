@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from users.images import DEFAULT_IMAGE, build_variants
+from users.models import Profile
+
+
+class Command(BaseCommand):
+    help = 'Create the resized variants of uploaded profile pictures.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Rebuild variants that already exist.',
+        )
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.exclude(image=DEFAULT_IMAGE).exclude(image='').only('pk', 'image')
+        written = 0
+        for profile in profiles.iterator():
+            written += len(build_variants(profile.image, force=options['force']))
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} thumbnails.'))
@@ -2,6 +2,7 @@ import uuid
 import os
 from django.db import models
 from django.contrib.auth.models import User
+from .images import variant_urls
 
 
 def upload_to(instance, filename):
@@ -18,3 +19,46 @@ class Profile(models.Model):
 
     def __str__(self):
         return self.user.username
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_values = instance._tracked_values()
+        return instance
+
+    def _tracked_values(self):
+        return {
+            field.name: field.get_prep_value(field.value_from_object(self))
+            for field in self._meta.concrete_fields
+            if not field.primary_key and field.attname in self.__dict__
+        }
+
+    def changed_fields(self):
+        """Names of the fields changed since the profile was loaded or saved, None if it never was."""
+        saved = getattr(self, '_saved_values', None)
+        if saved is None:
+            return None
+        return [name for name, value in self._tracked_values().items() if saved.get(name) != value]
+
+    def saved_value(self, name):
+        """Value of a field when the profile was loaded or last saved, None if it never was."""
+        return getattr(self, '_saved_values', {}).get(name)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._saved_values = self._tracked_values()
+
+    def _thumbnail(self, fmt):
+        urls = variant_urls(self.image)
+        if not urls:
+            return self.image.url
+        return urls[min(urls)][fmt]
+
+    @property
+    def thumbnail_url(self):
+        """URL of the smallest JPEG thumbnail, or of the picture itself when there is none."""
+        return self._thumbnail('jpeg')
+
+    @property
+    def thumbnail_webp_url(self):
+        return self._thumbnail('webp')
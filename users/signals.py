@@ -1,7 +1,10 @@
 from django.db.models.signals import post_save
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.dispatch import receiver
+from functools import partial
 from .models import Profile
+from .images import build_variants, delete_variants
 
 
 @receiver(post_save, sender=User)
@@ -10,6 +13,38 @@ def build_profile(sender, instance, created, **kwargs):
         Profile.objects.create(user=instance)
 
 
+def build_profiles(users):
+    """Create the missing profiles of users added with ``bulk_create``, which sends no signals."""
+    users = list(users)
+    if any(user.pk is None for user in users):
+        # The database did not return the new primary keys
+        users = User.objects.filter(username__in=[user.username for user in users])
+    have_profile = set(Profile.objects.filter(user__in=users).values_list('user_id', flat=True))
+    return Profile.objects.bulk_create([Profile(user=user) for user in users if user.pk not in have_profile])
+
+
 @receiver(post_save, sender=User)
-def save_profile(sender, instance, **kwargs):
-    instance.profile.save()
\ No newline at end of file
+def save_profile(sender, instance, created, **kwargs):
+    # Logins and other user updates do not touch the profile - only save one edited through the user
+    if created or not User.profile.is_cached(instance):
+        return
+    try:
+        profile = instance.profile
+    except Profile.DoesNotExist:
+        return
+    changed = profile.changed_fields()
+    if changed is None or profile.pk is None:
+        profile.save()
+    elif changed:
+        profile.save(update_fields=changed)
+
+
+@receiver(post_save, sender=Profile)
+def build_image_variants(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'image' in update_fields:
+        build_variants(instance.image)
+        # The thumbnails of a replaced picture are never served again
+        previous = instance.saved_value('image')
+        if previous and previous != instance.image.name:
+            previous_image = instance.image.field.attr_class(instance, instance.image.field, previous)
+            transaction.on_commit(partial(delete_variants, previous_image))
@@ -1,3 +1,104 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from food.models import Item
+from mysite.query_budget import QueryBudgetTestMixin
+from .models import Profile
+from .signals import build_profiles
+
+
+class ProfileSyncTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+
+    def test_user_save_skips_profile(self):
+        """Test saving a user without touching the profile writes only the user."""
+        user = User.objects.get(pk=self.user.pk)
+        user.last_login = timezone.now()
+        with self.assertNumQueries(1):
+            user.save(update_fields=['last_login'])
+
+    def test_unchanged_profile_is_not_saved(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.profile
+        user.email = 'test@example.com'
+        with self.assertNumQueries(1):
+            user.save(update_fields=['email'])
+
+    def test_changed_profile_is_saved(self):
+        """Test a profile edited through its user is saved with it."""
+        user = User.objects.get(pk=self.user.pk)
+        user.profile.location = 'Sofia'
+        user.save()
+        self.assertEqual(Profile.objects.get(user=self.user).location, 'Sofia')
+
+    def test_build_profiles_for_bulk_created_users(self):
+        users = User.objects.bulk_create([User(username='bulk1'), User(username='bulk2')])
+        build_profiles(users + [self.user])
+        self.assertEqual(Profile.objects.filter(user__username__in=['bulk1', 'bulk2']).count(), 2)
+        self.assertEqual(Profile.objects.filter(user=self.user).count(), 1)
+
+
+@override_settings(PROFILE_RECIPES_PAGE_SIZE=2)
+class ProfilePageTest(QueryBudgetTestMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.items = [
+            Item.objects.create(
+                item_name=f'Recipe {i}',
+                item_desc='Tasty',
+                cooking_time=timedelta(minutes=10),
+                user_name=self.user,
+                publish_date=timezone.now() - timedelta(days=i),
+            )
+            for i in range(3)
+        ]
+        self.client.login(username='testuser', password='testpass')
+        self.url = reverse('profile', kwargs={'username': 'testuser'})
+
+    def test_recipes_are_paginated(self):
+        """Test the newest recipes come first, a page at a time."""
+        res = self.client.get(self.url)
+        self.assertContains(res, 'Recipe 0')
+        self.assertContains(res, 'Recipe 1')
+        self.assertNotContains(res, 'Recipe 2')
+        self.assertContains(res, 'Next')
+
+    def test_recipe_list_is_cached(self):
+        """Test the recipe list is only queried until it is cached."""
+        self.client.get(self.url)
+        with self.assertNumQueries(4):
+            # session, user, profile joined to its user, and the version of the recipe list
+            res = self.client.get(self.url)
+        self.assertContains(res, 'Recipe 0')
+
+    def test_new_recipe_invalidates_list(self):
+        self.client.get(self.url)
+        Item.objects.create(
+            item_name='Fresh recipe', item_desc='New', cooking_time=timedelta(minutes=5), user_name=self.user,
+        )
+        self.assertContains(self.client.get(self.url), 'Fresh recipe')
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(self.url, {'cursor': 'nope'}).status_code, 404)
+
+    def test_unknown_user(self):
+        res = self.client.get(reverse('profile', kwargs={'username': 'nobody'}))
+        self.assertEqual(res.status_code, 404)
+
+    @override_settings(PROFILE_RECIPES_PAGE_SIZE=20)
+    def test_query_budget(self):
+        """Test the page runs the same queries however many recipes are listed."""
+        def grow(size):
+            for i in range(size - Item.objects.count()):
+                Item.objects.create(item_name='More', item_desc='Tasty', cooking_time=timedelta(minutes=5), user_name=self.user)
+
+        self.assertQueryBudget(lambda size: self.client.get(self.url), [3, 10, 20], grow=grow)
@@ -1,4 +1,6 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import Http404
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 # from django.contrib.auth.forms import UserCreationForm - initial version - extended the form with RegisterForm
 from django.contrib import messages
@@ -6,6 +8,12 @@ from .forms import RegisterForm
 from django.contrib.auth.models import User
 from .models import Profile
 from food.models import Item
+from food.fragments import author_version
+from food.pagination import InvalidCursor, KeysetPage, decode_cursor, paginate
+from mysite.query_budget import query_budget
+
+# newest first - matches the food_item_author_published_idx index
+RECIPE_ORDERING = ('-publish_date', '-id')
 
 
 def register(request):
@@ -26,9 +34,29 @@ def register(request):
 
 
 @login_required
+@query_budget(5)
 def profilepage(request, username=None):
-    username = get_object_or_404(User, username=username)
-    user = get_object_or_404(User, username=username)
-    profile = get_object_or_404(Profile, user=user)
-    items = Item.objects.filter(user_name=user)
-    return render(request, 'users/profile.html', {'profile': profile, 'username': username, 'items': items})
+    # the user comes joined to the profile - one query for both
+    profile = get_object_or_404(Profile.objects.select_related('user'), user__username=username)
+    author = profile.user
+    cursor = request.GET.get('cursor', '')
+    if cursor:
+        try:
+            decode_cursor(cursor, RECIPE_ORDERING)
+        except InvalidCursor:
+            raise Http404('Invalid cursor')
+
+    def recipes():
+        # called by the template only when the cached recipe list is missing
+        queryset = Item.objects.filter(user_name=author).only('id', 'item_name', 'publish_date', 'update_date')
+        page_size = getattr(settings, 'PROFILE_RECIPES_PAGE_SIZE', 10)
+        return KeysetPage(*paginate(queryset, RECIPE_ORDERING, page_size, cursor))
+
+    context = {
+        'profile': profile,
+        'username': author.username,
+        'recipes': recipes,
+        'recipes_version': author_version(author.pk),
+        'cursor': cursor,
+    }
+    return render(request, 'users/profile.html', context)